@@ -19,7 +19,6 @@
 
 from __future__ import unicode_literals
 
-from itertools import islice
 import typing as t
 
 import renpy
@@ -75,8 +74,38 @@ class suppress(object):
         return exctype is not None and issubclass(exctype, self._exceptions)
 
 
-def grouper(iterable, n):
-    # type: (t.Iterable[T], int) -> tuple[tuple[T, ...], ...]
-    """Group items from iterable into `n` sized chunks, the last chunk may be smaller than n."""
-    it = iter(iterable)
-    return tuple(iter(lambda: tuple(islice(it, n)), ()))
+class PagedSequence(t.Generic[T]):
+    """
+    Lazy view of `sequence` split into `page_size` sized pages, the last page may be smaller than `page_size`.
+
+    Pages are sliced from the underlying sequence on access, so changes to it are reflected in the view.
+    """
+
+    __slots__ = ("sequence", "page_size")
+
+    def __init__(self, sequence, page_size):
+        # type: (t.Sequence[T], int) -> None
+        self.sequence = sequence
+        self.page_size = page_size
+
+    def __len__(self):
+        # type: () -> int
+        return -(-len(self.sequence) // self.page_size)
+
+    def __getitem__(self, index):
+        # type: (int) -> t.Sequence[T]
+        page_count = len(self)
+        if index < 0:
+            index += page_count
+        if not 0 <= index < page_count:
+            raise IndexError("page index out of range")
+        start = index * self.page_size
+        return self.sequence[start:start + self.page_size]
+
+    def __iter__(self):
+        # type: () -> t.Iterator[t.Sequence[T]]
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return "{}({!r}, {!r})".format(self.__class__.__name__, self.sequence, self.page_size)
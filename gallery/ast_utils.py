@@ -6,12 +6,15 @@ from __future__ import unicode_literals
 import copy
 import difflib
 from collections import deque, namedtuple
+from itertools import islice
 import typing as t
 
 import renpy.ast
 import renpy.game
 from renpy.sl2 import slast
 
+from .label_graph import label_graph
+
 if t.TYPE_CHECKING:
     import typing_extensions as te
     P = te.ParamSpec("P")
@@ -27,6 +30,7 @@ __all__ = [
     "WrappedSlNode",
     "walk_sl_ast",
     "walk_ast",
+    "walk_static_path",
     "find_call",
     "find_say",
     "find_label",
@@ -40,8 +44,14 @@ __all__ = [
     "patch_after_node",
     "mark_node_patched",
     "create_artificial_label",
+    "artificial_labels",
     "create_end_replay_node",
+    "is_end_replay_node",
     "get_nth_after",
+    "get_prediction_images",
+    "get_first_dialogue",
+    "LabelLockTable",
+    "replay_label_locks",
 ]
 
 
@@ -95,6 +105,38 @@ def walk_ast(node):
     return flattened_tree
 
 
+def walk_static_path(node):
+    # type: (renpy.ast.Node) -> t.Iterator[renpy.ast.Node]
+    """
+    Yield `node` and all the nodes that are directly executed after it, up to the end of the replay.
+
+    Static calls and jumps are followed, returns continue after the call they return from.
+    The nodes are followed through their next nodes, so the nodes patched into the script are included,
+    and the path ends before a replay end node. Only the nodes on the path are visited, so walking the start
+    of a long script is cheap compared to building its control flow graph.
+    The path may be infinite if the script loops back on itself.
+    """
+    call_stack = []
+    while node is not None and not is_end_replay_node(node):
+        yield node
+
+        if isinstance(node, renpy.ast.Call) and not node.expression and renpy.game.script.has_label(node.label):
+            call_stack.append(node)
+            node = renpy.game.script.lookup(node.label)
+
+        elif isinstance(node, renpy.ast.Jump):
+            # the next node of jumps isn't executed, even though it's set
+            if node.expression or not renpy.game.script.has_label(node.target):
+                return
+            node = renpy.game.script.lookup(node.target)
+
+        elif isinstance(node, renpy.ast.Return) or node.next is None:
+            node = call_stack.pop().next if call_stack else None
+
+        else:
+            node = node.next
+
+
 def _find_node(type_, predicate, start_node, return_previous):
     # type: (type[T], t.Callable, renpy.ast.Node, bool) -> T | None
     """
@@ -350,10 +392,15 @@ def _load_patch_nodes():
     mark_node_patched(_stop_replay_node)
 
 
+artificial_labels = set()  # type: set[t.Text]
+
+
 def create_artificial_label(node, name):
     # type: (renpy.ast.Node, t.Text) -> None
-    """Make `node` a "label" with `name`."""
+    """Make `node` a "label" with `name`, the name is added to `artificial_labels`."""
     renpy.game.script.namemap[name] = copy.copy(node)
+    artificial_labels.add(name)
+    replay_label_locks.invalidate()
 
 
 def create_end_replay_node():
@@ -364,6 +411,12 @@ def create_end_replay_node():
     return copy.copy(_stop_replay_node)
 
 
+def is_end_replay_node(node):
+    # type: (renpy.ast.Node) -> bool
+    """Return True if `node` is a replay end node created by `create_end_replay_node`."""
+    return _stop_replay_node is not None and node.name == _stop_replay_node.name
+
+
 def get_nth_after(node, n):
     # type: (renpy.ast.Node, int) -> renpy.ast.Node | None
     """Get the `n`th node after `node`."""
@@ -373,6 +426,117 @@ def get_nth_after(node, n):
     return to_return
 
 
+class LabelLockTable(object):
+    """
+    Precomputed set of registered labels that exist in the script.
+
+    The set is recomputed only after it's invalidated by the creation of an artificial label,
+    or when the script is reloaded.
+    """
+
+    def __init__(self):
+        self._labels = set()  # type: set[t.Text]
+        self._unlocked = None  # type: frozenset[t.Text] | None
+        self._script = None  # type: renpy.script.Script | None
+
+    def register(self, label_names):
+        # type: (t.Iterable[t.Text]) -> None
+        """Add `label_names` to the labels whose lock state is tracked."""
+        self._labels.update(label_names)
+        self._unlocked = None
+
+    def invalidate(self):
+        # type: () -> None
+        """Recompute the unlocked labels on next access."""
+        self._unlocked = None
+
+    @property
+    def unlocked(self):
+        # type: () -> frozenset[t.Text]
+        """All registered labels that exist in the script."""
+        if self._script is not renpy.game.script:
+            self._script = renpy.game.script
+            self._unlocked = None
+        if self._unlocked is None:
+            self._unlocked = frozenset(filter(self._script.has_label, self._labels))
+        return self._unlocked
+
+    def is_unlocked(self, label_name):
+        # type: (t.Text) -> bool
+        """Return True if the label `label_name` exists, registering it if it wasn't yet."""
+        if label_name not in self._labels:
+            self.register((label_name,))
+        return label_name in self.unlocked
+
+    def unlocked_count(self, label_names):
+        # type: (t.Iterable[t.Text]) -> int
+        """Get the number of labels from `label_names` that are unlocked."""
+        return len(self.unlocked.intersection(label_names))
+
+    def reachable_from(self, node):
+        # type: (renpy.ast.Node) -> frozenset[t.Text]
+        """
+        Get the unlocked labels that can be reached after `node` is executed, according to the label graph.
+
+        The label graph is built from the whole script's control flow graph on first use.
+        """
+        return label_graph().reachable_labels(node, self.unlocked)
+
+
+replay_label_locks = LabelLockTable()
+
+
+_prediction_images_cache = {}  # type: dict[tuple[t.Text, int], tuple[t.Text, ...]]
+
+
+def get_prediction_images(label_name, node_count):
+    # type: (t.Text, int) -> tuple[t.Text, ...]
+    """
+    Get the names of images from scenes and shows in the first `node_count` nodes reachable from `label_name`.
+
+    Static calls and jumps are followed. The results are cached per label,
+    an empty tuple is returned without caching if the label doesn't exist.
+    """
+    cache_key = (label_name, node_count)
+    cached_images = _prediction_images_cache.get(cache_key)
+    if cached_images is not None:
+        return cached_images
+    if not renpy.game.script.has_label(label_name):
+        return ()
+
+    images = []
+    start_node = renpy.game.script.lookup(label_name)
+    for node in islice(walk_static_path(start_node), node_count):
+        if (
+            isinstance(node, (renpy.ast.Scene, renpy.ast.Show))
+            and node.imspec is not None
+            and node.imspec[1] is None  # images shown from expressions can't be resolved statically
+        ):
+            name = " ".join(node.imspec[0])
+            if name not in images:
+                images.append(name)
+
+    _prediction_images_cache[cache_key] = images = tuple(images)
+    return images
+
+
+def get_first_dialogue(label_name, node_count):
+    # type: (t.Text, int) -> t.Text | None
+    """
+    Get the text of the first say node in the first `node_count` nodes reachable from `label_name`.
+
+    None is returned if the label doesn't exist or no say node was found.
+    """
+    if not renpy.game.script.has_label(label_name):
+        return None
+
+    start_node = renpy.game.script.lookup(label_name)
+    for node in islice(walk_static_path(start_node), node_count):
+        if isinstance(node, renpy.ast.Say):
+            return node.what
+    return None
+
+
 def _transform_args_to_hashable(args):
     # type: (tuple[object, ...]) -> tuple[t.Hashable, ...]
     """
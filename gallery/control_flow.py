@@ -0,0 +1,641 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+"""
+Control flow graph of the whole script.
+
+The graph is made out of basic blocks, runs of nodes that are always executed one after another.
+Nodes are identified by their position in the script's statements, so the graph can be cached to a file
+and loaded back as long as the script's digest didn't change.
+Nodes patched into the script aren't a part of the graph, it's built from the script's own statements.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import pickle
+import threading
+import typing as t
+from array import array
+
+import renpy
+import renpy.ast
+import renpy.config
+import renpy.game
+
+__all__ = [
+    "ControlFlowGraph",
+    "control_flow_graph",
+    "load_control_flow_graph_in_background",
+    "strongly_connected_components",
+    "CACHE_FILENAME",
+]
+
+CACHE_FILENAME = "renpy_gallery_inject_cfg.pickle"
+# Incremented when the structure of the cached graph changes
+_CACHE_VERSION = 4
+
+_NEXT = 0
+_CALL = 1
+_JUMP = 2
+
+
+class ControlFlowGraph(object):
+    """
+    Basic blocks of the statements in `nodes` and the control flow between them.
+
+    Blocks end at calls, jumps, returns, and menu, if and while nodes.
+    Every block can be followed by the block its last node's `next` leads to, which is the return site for calls,
+    the block a static call or jump leads to, and the first blocks of a menu's, if's or while's branches.
+    """
+
+    def __init__(
+        self,
+        nodes,  # type: t.Sequence[renpy.ast.Node]
+        block_nodes,  # type: array[int]
+        block_offsets,  # type: array[int]
+        kinds,  # type: array[int]
+        fallthroughs,  # type: array[int]
+        transfers,  # type: array[int]
+        branches,  # type: dict[int, tuple[int, ...]]
+        node_blocks,  # type: array[int]
+        node_offsets,  # type: array[int]
+        post_dominators=None,  # type: array[int] | None
+    ):  # type: (...) -> None
+        self._nodes = nodes
+        self._node_ids = {node: node_id for node_id, node in enumerate(nodes)}
+        self._block_nodes = block_nodes
+        self._block_offsets = block_offsets
+        self._kinds = kinds
+        self._fallthroughs = fallthroughs
+        self._transfers = transfers
+        self._branches = branches
+        self._node_blocks = node_blocks
+        self._node_offsets = node_offsets
+        if post_dominators is None:
+            post_dominators = _immediate_post_dominators(self)
+        self._post_dominators = post_dominators
+
+    @classmethod
+    def from_script(cls, script):
+        # type: (renpy.script.Script) -> ControlFlowGraph
+        """Build the graph from the statements of `script`."""
+        nodes = list(script.all_stmts)
+        node_ids = {node: node_id for node_id, node in enumerate(nodes)}
+
+        def resolve(node):
+            # type: (renpy.ast.Node | None) -> int
+            """Get the id of `node`, or of the first script node after it if it was patched in. -1 for None."""
+            while node is not None:
+                node_id = _script_node_id(node, node_ids, script.namemap)
+                if node_id is not None:
+                    return node_id
+                node = node.next
+            return -1
+
+        def lookup(label_name):
+            # type: (t.Text) -> int
+            if not script.has_label(label_name):
+                return -1
+            return resolve(script.lookup(label_name))
+
+        node_count = len(nodes)
+        node_kinds = array("b", [_NEXT]) * node_count
+        node_nexts = array("i", [-1]) * node_count
+        node_transfers = array("i", [-1]) * node_count
+        node_branches = {}  # type: dict[int, tuple[int, ...]]
+        predecessor_counts = array("i", [0]) * node_count
+        leaders = bytearray(node_count)
+
+        for node_id, node in enumerate(nodes):
+            # execution doesn't continue to the next node of jumps and returns, even though it's set
+            if not isinstance(node, (renpy.ast.Jump, renpy.ast.Return)):
+                next_id = node_nexts[node_id] = resolve(node.next)
+                if next_id != -1:
+                    predecessor_counts[next_id] += 1
+
+            if isinstance(node, renpy.ast.Call) and not node.expression:
+                node_kinds[node_id] = _CALL
+                node_transfers[node_id] = lookup(node.label)
+            elif isinstance(node, renpy.ast.Jump) and not node.expression:
+                node_kinds[node_id] = _JUMP
+                node_transfers[node_id] = lookup(node.target)
+
+            if isinstance(node, renpy.ast.Menu):
+                blocks = [block for _, _, block in node.items if block]
+            elif isinstance(node, renpy.ast.If):
+                blocks = [block for _, block in node.entries if block]
+            elif isinstance(node, renpy.ast.While):
+                blocks = [node.block]
+            else:
+                blocks = []
+            if blocks:
+                node_branches[node_id] = tuple(resolve(block[0]) for block in blocks)
+
+        for node_id, node in enumerate(nodes):
+            ends_block = (
+                node_kinds[node_id] != _NEXT
+                or node_id in node_branches
+                or isinstance(node, (renpy.ast.Call, renpy.ast.Jump, renpy.ast.Return))
+            )
+            if isinstance(node, renpy.ast.Label) or predecessor_counts[node_id] != 1:
+                leaders[node_id] = True
+            if ends_block and node_nexts[node_id] != -1:
+                leaders[node_nexts[node_id]] = True
+            if node_transfers[node_id] != -1:
+                leaders[node_transfers[node_id]] = True
+            for branch_id in node_branches.get(node_id, ()):
+                leaders[branch_id] = True
+
+        block_nodes = array("i")
+        block_offsets = array("i", [0])
+        node_blocks = array("i", [-1]) * node_count
+        node_offsets = array("i", [0]) * node_count
+        block_last_nodes = []  # type: list[int]
+
+        # nodes that aren't reachable from a leader, like the nodes of a .next cycle, start their own blocks
+        for start_id in list(filter(leaders.__getitem__, range(node_count))) + list(range(node_count)):
+            if node_blocks[start_id] != -1:
+                continue
+            block = len(block_last_nodes)
+            node_id = start_id
+            offset = 0
+            while True:
+                node_blocks[node_id] = block
+                node_offsets[node_id] = offset
+                block_nodes.append(node_id)
+                offset += 1
+                next_id = node_nexts[node_id]
+                if (
+                    next_id == -1
+                    or leaders[next_id]
+                    or node_blocks[next_id] != -1
+                    or node_kinds[node_id] != _NEXT
+                    or node_id in node_branches
+                ):
+                    break
+                node_id = next_id
+            block_offsets.append(len(block_nodes))
+            block_last_nodes.append(node_id)
+
+        kinds = array("b", (node_kinds[node_id] for node_id in block_last_nodes))
+        fallthroughs = array(
+            "i", (node_blocks[node_nexts[node_id]] if node_nexts[node_id] != -1 else -1 for node_id in block_last_nodes)
+        )
+        transfers = array(
+            "i",
+            (
+                node_blocks[node_transfers[node_id]] if node_transfers[node_id] != -1 else -1
+                for node_id in block_last_nodes
+            ),
+        )
+        branches = {
+            node_blocks[node_id]: tuple(node_blocks[branch_id] for branch_id in branch_ids if branch_id != -1)
+            for node_id, branch_ids in node_branches.items()
+        }
+
+        return cls(
+            nodes, block_nodes, block_offsets, kinds, fallthroughs, transfers, branches, node_blocks, node_offsets
+        )
+
+    @classmethod
+    def load(cls, filename, script, digest):
+        # type: (t.Text, renpy.script.Script, t.Text) -> ControlFlowGraph | None
+        """Load the graph of `script` cached at `filename`, None is returned if it's missing or `digest` differs."""
+        try:
+            with open(filename, "rb") as file:
+                data = pickle.load(file)
+        except Exception:
+            return None
+
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != _CACHE_VERSION
+            or data.get("digest") != digest
+            or data.get("node_count") != len(script.all_stmts)
+        ):
+            return None
+        return cls(
+            list(script.all_stmts),
+            data["block_nodes"],
+            data["block_offsets"],
+            data["kinds"],
+            data["fallthroughs"],
+            data["transfers"],
+            data["branches"],
+            data["node_blocks"],
+            data["node_offsets"],
+            data["post_dominators"],
+        )
+
+    def save(self, filename, digest):
+        # type: (t.Text, t.Text) -> None
+        """Cache the graph to `filename` for the script with `digest`."""
+        data = {
+            "version": _CACHE_VERSION,
+            "digest": digest,
+            "node_count": len(self._nodes),
+            "block_nodes": self._block_nodes,
+            "block_offsets": self._block_offsets,
+            "kinds": self._kinds,
+            "fallthroughs": self._fallthroughs,
+            "transfers": self._transfers,
+            "branches": self._branches,
+            "node_blocks": self._node_blocks,
+            "node_offsets": self._node_offsets,
+            "post_dominators": self._post_dominators,
+        }
+        temporary_filename = filename + ".tmp"
+        with open(temporary_filename, "wb") as file:
+            pickle.dump(data, file, protocol=2)
+        os.replace(temporary_filename, filename)
+
+    @property
+    def block_count(self):
+        # type: () -> int
+        return len(self._kinds)
+
+    @property
+    def node_count(self):
+        # type: () -> int
+        return len(self._nodes)
+
+    def node_id(self, node):
+        # type: (renpy.ast.Node) -> int | None
+        """
+        Get the id of `node` in the graph.
+
+        Copies of script nodes, like the ones created for artificial labels, have the id of their original,
+        and other patched in nodes the id of the first script node after them.
+        None is returned if no script node is found.
+        """
+        namemap = renpy.game.script.namemap
+        while node is not None:
+            node_id = _script_node_id(node, self._node_ids, namemap)
+            if node_id is not None:
+                return node_id
+            node = node.next
+        return None
+
+    def node(self, node_id):
+        # type: (int) -> renpy.ast.Node
+        """Get the node with the id `node_id`."""
+        return self._nodes[node_id]
+
+    def block_of(self, node):
+        # type: (renpy.ast.Node) -> tuple[int, int] | None
+        """Get the block `node` is in with the node's offset in it, or None if it has no id."""
+        node_id = self.node_id(node)
+        if node_id is None:
+            return None
+        return self._node_blocks[node_id], self._node_offsets[node_id]
+
+    def block_nodes(self, block, start=0):
+        # type: (int, int) -> list[renpy.ast.Node]
+        """Get the nodes in `block`, starting at the `start` offset."""
+        return [
+            self._nodes[node_id]
+            for node_id in self._block_nodes[self._block_offsets[block] + start:self._block_offsets[block + 1]]
+        ]
+
+    def successors(self, block):
+        # type: (int) -> list[int]
+        """
+        Get the blocks that can be executed directly after `block`.
+
+        Calls are treated as returning to the block after them, jumps lead to their target even in other labels.
+        """
+        successors = list(self._branches.get(block, ()))
+        if self._kinds[block] == _JUMP and self._transfers[block] != -1:
+            successors.append(self._transfers[block])
+        if self._fallthroughs[block] != -1:
+            successors.append(self._fallthroughs[block])
+        return successors
+
+    def call_target(self, block):
+        # type: (int) -> int
+        """Get the block called by the static call that ends `block`, -1 if it doesn't end with one."""
+        return self._transfers[block] if self._kinds[block] == _CALL else -1
+
+    def jump_target(self, block):
+        # type: (int) -> int
+        """Get the block jumped to by the static jump that ends `block`, -1 if it doesn't end with one."""
+        return self._transfers[block] if self._kinds[block] == _JUMP else -1
+
+    def last_node(self, block):
+        # type: (int) -> renpy.ast.Node
+        """Get the last node of `block`."""
+        return self._nodes[self._block_nodes[self._block_offsets[block + 1] - 1]]
+
+    def branch_nodes(self, node):
+        # type: (renpy.ast.Node) -> list[renpy.ast.Node]
+        """Get the first nodes of the branches of the menu, if or while `node`."""
+        location = self.block_of(node)
+        if location is None:
+            return []
+        return [self.block_nodes(branch)[0] for branch in self._branches.get(location[0], ())]
+
+    def merge_node(self, node):
+        # type: (renpy.ast.Node) -> renpy.ast.Node | None
+        """
+        Get the first node all the branches of `node` go through after it, or None if they never merge.
+
+        The node starts the block that immediately post-dominates `node`'s block. Jumps are followed across labels,
+        and loops that never reach the end of the script are treated as ending where they loop back to their entry.
+        """
+        location = self.block_of(node)
+        if location is None:
+            return None
+        post_dominator = self._post_dominators[location[0]]
+        if post_dominator == -1:
+            return None
+        return self.block_nodes(post_dominator)[0]
+
+    def static_path(self, node, call_stack=()):
+        # type: (renpy.ast.Node, t.Iterable[renpy.ast.Node]) -> t.Iterator[tuple[renpy.ast.Node, tuple]]
+        """
+        Yield `node` and all the nodes that are directly executed after it with the static calls they're under.
+
+        Static calls and jumps are followed, returns continue after the call they return from,
+        and `call_stack` are the calls the path starts under.
+        The path may be infinite if the script loops back on itself.
+        """
+        call_stack = tuple(call_stack)
+        location = self.block_of(node)
+        if location is None:
+            return
+        block, offset = location
+
+        while True:
+            for block_node in self.block_nodes(block, offset):
+                yield block_node, call_stack
+            offset = 0
+
+            if self.call_target(block) != -1:
+                call_stack += (self.last_node(block),)
+                block = self._transfers[block]
+                continue
+            elif self.jump_target(block) != -1:
+                block = self._transfers[block]
+                continue
+            elif self._fallthroughs[block] != -1:
+                block = self._fallthroughs[block]
+                continue
+
+            while call_stack:
+                call_location = self.block_of(call_stack[-1])
+                call_stack = call_stack[:-1]
+                if call_location is not None and self._fallthroughs[call_location[0]] != -1:
+                    block = self._fallthroughs[call_location[0]]
+                    break
+            else:
+                return
+
+
+def _script_node_id(node, node_ids, namemap):
+    # type: (renpy.ast.Node, dict[renpy.ast.Node, int], dict[object, renpy.ast.Node]) -> int | None
+    """
+    Get the id of `node` from `node_ids`, or of its original if it's an unpatched copy of a script node.
+
+    Copies of nodes, like the ones used for artificial labels, keep the original's name.
+    Patched nodes may also be copies that keep their original's name, like replay end nodes,
+    but they're not a part of the script so None is returned for them.
+    """
+    node_id = node_ids.get(node)
+    if node_id is not None or node.filename.startswith("patched"):
+        return node_id
+    return node_ids.get(namemap.get(node.name))
+
+
+_graph = None  # type: ControlFlowGraph | None
+_graph_script = None  # type: renpy.script.Script | None
+_graph_lock = threading.Lock()
+
+
+def control_flow_graph():
+    # type: () -> ControlFlowGraph
+    """
+    Get the graph of the current script.
+
+    The graph is loaded from the cache file in the save directory if it was built for the same script,
+    otherwise it's built and cached.
+    """
+    global _graph, _graph_script
+    with _graph_lock:
+        script = renpy.game.script
+        if _graph is not None and _graph_script is script:
+            return _graph
+
+        digest = script.digest.hexdigest()
+        filename = os.path.join(renpy.config.savedir, CACHE_FILENAME) if renpy.config.savedir else None
+        graph = None
+        if filename is not None:
+            graph = ControlFlowGraph.load(filename, script, digest)
+        if graph is None:
+            graph = ControlFlowGraph.from_script(script)
+            if filename is not None:
+                try:
+                    graph.save(filename, digest)
+                except (IOError, OSError):
+                    pass
+
+        _graph = graph
+        _graph_script = script
+        return graph
+
+
+def load_control_flow_graph_in_background():
+    # type: () -> None
+    """
+    Start loading or building the graph of the current script on a worker thread, if it isn't loaded yet.
+
+    Callers of `control_flow_graph` wait for the worker to finish instead of loading the graph again.
+    """
+    if _graph is not None and _graph_script is renpy.game.script:
+        return
+    thread = threading.Thread(target=control_flow_graph, name="Control flow graph loader")
+    thread.daemon = True
+    thread.start()
+
+
+def _immediate_post_dominators(graph):
+    # type: (ControlFlowGraph) -> array[int]
+    """
+    Get the immediate post-dominator of every block in `graph`.
+
+    Blocks without successors lead to a virtual exit, and so do the blocks looping back to the entry
+    of the loops the exit can't be reached from, see `_connect_exitless_components`.
+    Blocks with the exit as their post-dominator have -1.
+    Uses the iterative algorithm from Cooper, Harvey and Kennedy's "A Simple, Fast Dominance Algorithm"
+    on the reversed graph.
+    """
+    block_count = graph.block_count
+    exit_block = block_count
+    successors = [graph.successors(block) or [exit_block] for block in range(block_count)]
+    successors.append([])
+    _connect_exitless_components(successors, exit_block)
+    predecessors = _predecessors(successors)
+
+    # postorder of the reversed graph from the exit, iteratively to not hit the recursion limit on long scripts
+    order = array("i", [-1]) * (block_count + 1)
+    postorder = []  # type: list[int]
+    visited = bytearray(block_count + 1)
+    visited[exit_block] = True
+    stack = [(exit_block, iter(predecessors[exit_block]))]
+    while stack:
+        block, remaining = stack[-1]
+        for predecessor in remaining:
+            if not visited[predecessor]:
+                visited[predecessor] = True
+                stack.append((predecessor, iter(predecessors[predecessor])))
+                break
+        else:
+            stack.pop()
+            order[block] = len(postorder)
+            postorder.append(block)
+
+    dominators = array("i", [-1]) * (block_count + 1)
+    dominators[exit_block] = exit_block
+
+    def intersect(first, second):
+        # type: (int, int) -> int
+        while first != second:
+            while order[first] < order[second]:
+                first = dominators[first]
+            while order[second] < order[first]:
+                second = dominators[second]
+        return first
+
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(postorder):
+            if block == exit_block:
+                continue
+            new_dominator = -1
+            for successor in successors[block]:
+                if dominators[successor] == -1:
+                    continue
+                new_dominator = successor if new_dominator == -1 else intersect(successor, new_dominator)
+            if new_dominator != dominators[block]:
+                dominators[block] = new_dominator
+                changed = True
+
+    dominators.pop()
+    return array("i", (-1 if dominator == exit_block else dominator for dominator in dominators))
+
+
+def _predecessors(successors):
+    # type: (t.Sequence[t.Sequence[int]]) -> list[list[int]]
+    """Get the predecessors of every vertex of the graph with the `successors` of every vertex."""
+    predecessors = [[] for _ in successors]  # type: list[list[int]]
+    for vertex, vertex_successors in enumerate(successors):
+        for successor in vertex_successors:
+            predecessors[successor].append(vertex)
+    return predecessors
+
+
+def _connect_exitless_components(successors, exit_block):
+    # type: (list[list[int]], int) -> None
+    """
+    Add edges to `exit_block` to the `successors` of blocks, so the exit can be reached from every block.
+
+    The exit can't be reached from loops that are never left, like a hub label every branch jumps back to.
+    For every such strongly connected component that has no edges out of it, the blocks that loop back
+    to its entry, the lowest block entered from outside of it, get an edge to the exit.
+    That makes the branches inside the loop merge at the blocks looping back, like they would at a block
+    leading out of the loop.
+    """
+    predecessors = _predecessors(successors)
+    reaches_exit = bytearray(len(successors))
+    reaches_exit[exit_block] = True
+    stack = [exit_block]
+    while stack:
+        for predecessor in predecessors[stack.pop()]:
+            if not reaches_exit[predecessor]:
+                reaches_exit[predecessor] = True
+                stack.append(predecessor)
+    if all(reaches_exit):
+        return
+
+    components = strongly_connected_components(
+        [[] if reaches_exit[block] else block_successors for block, block_successors in enumerate(successors)]
+    )
+    # the exit can't be reached from any successor of an exitless block, so the components with no edges
+    # out of them are the ones whose blocks' successors are all in the same component
+    component_members = {}  # type: dict[int, list[int]]
+    left_components = set()
+    for block, block_successors in enumerate(successors):
+        if reaches_exit[block]:
+            continue
+        component = components[block]
+        component_members.setdefault(component, []).append(block)
+        if any(components[successor] != component for successor in block_successors):
+            left_components.add(component)
+
+    for component, members in component_members.items():
+        if component in left_components:
+            continue
+        entries = [
+            block
+            for block in members
+            if any(components[predecessor] != component for predecessor in predecessors[block])
+        ]
+        entry = min(entries or members)
+        for predecessor in predecessors[entry]:
+            if components[predecessor] == component:
+                successors[predecessor].append(exit_block)
+
+
+def strongly_connected_components(edges):
+    # type: (t.Sequence[t.Sequence[int]]) -> list[int]
+    """
+    Get the id of the component of every vertex of the graph with `edges`, with Tarjan's algorithm.
+
+    Components are numbered in the order they're completed, so every component's successors have lower ids.
+    """
+    vertex_count = len(edges)
+    indices = [-1] * vertex_count
+    low_links = [0] * vertex_count
+    on_stack = [False] * vertex_count
+    components = [-1] * vertex_count
+    stack = []  # type: list[int]
+    index = 0
+    component_count = 0
+
+    for root in range(vertex_count):
+        if indices[root] != -1:
+            continue
+        # the recursion is done with an explicit stack to not hit the recursion limit on long chains of vertices
+        work = [(root, 0)]
+        while work:
+            vertex, edge_index = work.pop()
+            if edge_index == 0:
+                indices[vertex] = low_links[vertex] = index
+                index += 1
+                stack.append(vertex)
+                on_stack[vertex] = True
+            else:
+                low_links[vertex] = min(low_links[vertex], low_links[edges[vertex][edge_index - 1]])
+
+            vertex_edges = edges[vertex]
+            while edge_index < len(vertex_edges):
+                successor = vertex_edges[edge_index]
+                edge_index += 1
+                if indices[successor] == -1:
+                    work.append((vertex, edge_index))
+                    work.append((successor, 0))
+                    break
+                elif on_stack[successor]:
+                    low_links[vertex] = min(low_links[vertex], indices[successor])
+            else:
+                if low_links[vertex] == indices[vertex]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        components[member] = component_count
+                        if member == vertex:
+                            break
+                    component_count += 1
+
+    return components
@@ -0,0 +1,319 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+"""
+Call and jump graph between the script's labels, with precomputed reachability.
+
+The labels are vertices of the graph, and a label has an edge to every label its code can call,
+jump, or fall through to without going through another label first.
+Returns are modelled with a vertex for the return site of every static call, which the called code returns to,
+and a vertex for returning from the code of every vertex.
+Vertices in the same strongly connected component can all reach each other,
+the labels reachable from every component are stored as a bitset so queries are constant time.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+import typing as t
+from collections import deque
+from itertools import islice
+
+import renpy
+import renpy.ast
+import renpy.game
+
+from .control_flow import ControlFlowGraph, control_flow_graph, strongly_connected_components
+
+__all__ = [
+    "LabelGraph",
+    "label_graph",
+]
+
+
+class LabelGraph(object):
+    """
+    Graph of the labels in the script of `graph`, built from its control flow.
+
+    The code of a vertex is the code from its block up to the labels and return sites it reaches.
+    Every vertex `vertex` has a return vertex `vertex + vertex_count`, which the vertex's code has an edge to
+    if it can return. The return vertex of a called label has edges to the return sites of its calls,
+    and the return vertex of code entered without a call has an edge to the return vertex of the code it was
+    entered from, as it returns wherever that code would.
+    """
+
+    def __init__(self, graph, namemap):
+        # type: (ControlFlowGraph, dict[object, renpy.ast.Node]) -> None
+        self._graph = graph
+        # block starting every label and return site -> id of its vertex, labels may start at the same block
+        self._vertex_ids = {}  # type: dict[int, int]
+        self._label_vertices = {}  # type: dict[t.Text, int]
+        # name describing every label vertex, names of label statements are preferred over artificial labels
+        vertex_names = {}  # type: dict[int, t.Text]
+        for name, node in namemap.items():
+            if not isinstance(name, type("")):
+                continue
+            location = graph.block_of(node)
+            if location is None:
+                continue
+            vertex = self._vertex_ids.setdefault(location[0], len(self._vertex_ids))
+            self._label_vertices[name] = vertex
+            if vertex not in vertex_names or isinstance(node, renpy.ast.Label):
+                vertex_names[vertex] = name
+        label_count = len(self._vertex_ids)
+        self._vertex_names = [vertex_names[vertex] for vertex in range(label_count)]
+
+        # static calls to labels with the vertex of their return site, the return sites get vertices after the labels
+        call_sites = []  # type: list[tuple[int, int]]
+        for block in range(graph.block_count):
+            called_vertex = self._vertex_ids.get(graph.call_target(block))
+            if called_vertex is None or called_vertex >= label_count:
+                continue
+            for return_block in graph.successors(block):
+                return_vertex = self._vertex_ids.setdefault(return_block, len(self._vertex_ids))
+                call_sites.append((called_vertex, return_vertex))
+
+        self._vertex_count = vertex_count = len(self._vertex_ids)
+        self._vertex_blocks = [0] * vertex_count
+        for block, vertex in self._vertex_ids.items():
+            self._vertex_blocks[vertex] = block
+        # vertex -> label vertex whose code it's a part of, -1 for return sites not reached from any label
+        self._vertex_labels = list(range(label_count)) + [-1] * (vertex_count - label_count)
+        # block -> vertex whose code the block is in
+        self._block_vertices = dict(self._vertex_ids)  # type: dict[int, int]
+
+        self._edges = [[] for _ in range(2 * vertex_count)]  # type: list[list[int]]
+        for called_vertex, return_vertex in call_sites:
+            self._edges[called_vertex + vertex_count].append(return_vertex)
+        self._add_code_edges(label_count)
+
+        self._components = strongly_connected_components(self._edges)
+        self._label_bits = self._label_component_bits(label_count)
+        self._reachable = self._reachability()
+        self._block_reach_cache = {}  # type: dict[int, bytearray]
+        self._lock = threading.Lock()
+
+    def __contains__(self, label_name):
+        # type: (t.Text) -> bool
+        return label_name in self._label_vertices
+
+    @property
+    def label_names(self):
+        # type: () -> t.KeysView[t.Text]
+        return self._label_vertices.keys()
+
+    def same_component(self, first_label, second_label):
+        # type: (t.Text, t.Text) -> bool
+        """Return True if the two labels are in the same strongly connected component, so they can reach each other."""
+        return (
+            self._components[self._label_vertices[first_label]]
+            == self._components[self._label_vertices[second_label]]
+        )
+
+    def label_reachable(self, from_label, to_label):
+        # type: (t.Text, t.Text) -> bool
+        """
+        Return True if `to_label` can be reached from `from_label`.
+
+        A label is always reachable from itself. False is returned if either of the labels isn't in the graph.
+        """
+        from_vertex = self._label_vertices.get(from_label)
+        to_vertex = self._label_vertices.get(to_label)
+        if from_vertex is None or to_vertex is None:
+            return False
+        return _bit_set(self._reachable[self._components[from_vertex]], self._label_bits[to_vertex])
+
+    def node_reachable(self, node, label_name):
+        # type: (renpy.ast.Node, t.Text) -> bool
+        """
+        Return True if the label `label_name` can be reached after `node` is executed.
+
+        False is returned if the label or the node isn't in the graph.
+        """
+        to_vertex = self._label_vertices.get(label_name)
+        reach = self._node_reach(node)
+        if to_vertex is None or reach is None:
+            return False
+        return _bit_set(reach, self._label_bits[to_vertex])
+
+    def reachable_labels(self, node, label_names):
+        # type: (renpy.ast.Node, t.Iterable[t.Text]) -> frozenset[t.Text]
+        """
+        Get the labels from `label_names` that can be reached after `node` is executed.
+
+        No labels are returned if the node isn't in the graph.
+        """
+        reach = self._node_reach(node)
+        if reach is None:
+            return frozenset()
+        return frozenset(
+            label_name
+            for label_name in label_names
+            if label_name in self._label_vertices
+            and _bit_set(reach, self._label_bits[self._label_vertices[label_name]])
+        )
+
+    def label_of(self, node):
+        # type: (renpy.ast.Node) -> t.Text | None
+        """Get the name of the label whose code `node` is in, or None if it's not reachable from any label."""
+        location = self._graph.block_of(node)
+        if location is None:
+            return None
+        vertex = self._block_vertices.get(location[0])
+        if vertex is None or self._vertex_labels[vertex] == -1:
+            return None
+        return self._vertex_names[self._vertex_labels[vertex]]
+
+    def _add_code_edges(self, label_count):
+        # type: (int) -> None
+        """
+        Add the edges from the code of every vertex, and the edges between the return vertices of the code.
+
+        The labels' code is explored first, and the return sites are assigned to the label whose code reaches them.
+        """
+        vertex_count = self._vertex_count
+        explored = bytearray(vertex_count)
+        todo = deque(range(label_count))
+        unreached_return_sites = iter(range(label_count, vertex_count))
+        while True:
+            if not todo:
+                todo.extend(islice(unreached_return_sites, 1))
+                if not todo:
+                    break
+            vertex = todo.popleft()
+            if explored[vertex]:
+                continue
+            explored[vertex] = True
+
+            called, entered, returns = self._reached_vertices(self._vertex_blocks[vertex], vertex)
+            self._edges[vertex].extend(called)
+            self._edges[vertex].extend(entered)
+            if returns:
+                self._edges[vertex].append(vertex + vertex_count)
+            for entered_vertex in entered:
+                # code entered without a call returns wherever this vertex's code would
+                self._edges[entered_vertex + vertex_count].append(vertex + vertex_count)
+                if self._vertex_labels[entered_vertex] == -1:
+                    self._vertex_labels[entered_vertex] = self._vertex_labels[vertex]
+                    todo.append(entered_vertex)
+
+    def _node_reach(self, node):
+        # type: (renpy.ast.Node) -> bytearray | None
+        """
+        Get the bitset of the label components reachable after `node`, the result is cached per block.
+
+        None is returned if the node isn't in the graph.
+        """
+        location = self._graph.block_of(node)
+        if location is None:
+            return None
+        block = location[0]
+        with self._lock:
+            reach = self._block_reach_cache.get(block)
+        if reach is None:
+            called, entered, returns = self._reached_vertices(block)
+            reached = called + entered
+            vertex = self._block_vertices.get(block)
+            if returns and vertex is not None:
+                reached.append(vertex + self._vertex_count)
+            reach_bits = 0
+            for reached_vertex in reached:
+                reach_bits |= int.from_bytes(self._reachable[self._components[reached_vertex]], "little")
+            reach = bytearray(reach_bits.to_bytes(len(self._reachable[0]) if self._reachable else 0, "little"))
+            with self._lock:
+                self._block_reach_cache[block] = reach
+        return reach
+
+    def _reached_vertices(self, start_block, owner=None):
+        # type: (int, int | None) -> tuple[list[int], list[int], bool]
+        """
+        Get the vertices reached from the end of `start_block` before going through any other vertex.
+
+        The vertices of called labels and of the code entered without calls are returned separately,
+        with whether the code can return.
+        `start_block` itself is only reached if the code loops back to it.
+        If `owner` is passed, the visited blocks not in the code of another vertex are put into its code.
+        """
+        graph = self._graph
+        called = set()
+        entered = set()
+        returns = False
+        seen = {start_block}
+        todo = deque([start_block])
+        while todo:
+            block = todo.popleft()
+            if owner is not None:
+                self._block_vertices.setdefault(block, owner)
+            if isinstance(graph.last_node(block), renpy.ast.Return):
+                returns = True
+
+            call_target = graph.call_target(block)
+            if call_target != -1:
+                called.add(self._vertex_ids.get(call_target, -1))
+            for successor in graph.successors(block):
+                vertex = self._vertex_ids.get(successor)
+                if vertex is not None:
+                    entered.add(vertex)
+                elif successor not in seen:
+                    seen.add(successor)
+                    todo.append(successor)
+        called.discard(-1)
+        return sorted(called), sorted(entered), returns
+
+    def _label_component_bits(self, label_count):
+        # type: (int) -> list[int]
+        """
+        Get the bit of every label vertex's component in the reachability bitsets.
+
+        Only the components with labels get a bit, as only labels are queried.
+        """
+        component_bits = {}  # type: dict[int, int]
+        return [
+            component_bits.setdefault(self._components[vertex], len(component_bits)) for vertex in range(label_count)
+        ]
+
+    def _reachability(self):
+        # type: () -> list[bytearray]
+        """Get the bitset of label components reachable from every component, including the component itself."""
+        component_count = max(self._components) + 1 if self._components else 0
+        component_edges = [set() for _ in range(component_count)]  # type: list[set[int]]
+        for vertex, edges in enumerate(self._edges):
+            component_edges[self._components[vertex]].update(self._components[successor] for successor in edges)
+        own_bits = [0] * component_count
+        for vertex, bit in enumerate(self._label_bits):
+            own_bits[self._components[vertex]] = 1 << bit
+
+        reach_bits = [0] * component_count
+        byte_count = (max(self._label_bits) + 8) // 8 if self._label_bits else 0
+        reachable = []
+        # successors were completed before their predecessors, so their bits are final when they're used
+        for component in range(component_count):
+            bits = own_bits[component]
+            for successor in component_edges[component]:
+                bits |= reach_bits[successor]
+            reach_bits[component] = bits
+            reachable.append(bytearray(bits.to_bytes(byte_count, "little")))
+        return reachable
+
+
+def _bit_set(bitset, bit):
+    # type: (bytearray, int) -> bool
+    """Return True if `bit` is set in the little endian `bitset`."""
+    return bool(bitset[bit >> 3] & (1 << (bit & 7)))
+
+
+_label_graph = None  # type: LabelGraph | None
+_label_graph_source = None  # type: ControlFlowGraph | None
+_label_graph_lock = threading.Lock()
+
+
+def label_graph():
+    # type: () -> LabelGraph
+    """Get the label graph of the current script, it's built on first access after the control flow graph changes."""
+    global _label_graph, _label_graph_source
+    graph = control_flow_graph()
+    with _label_graph_lock:
+        if _label_graph is None or _label_graph_source is not graph:
+            _label_graph = LabelGraph(graph, renpy.game.script.namemap)
+            _label_graph_source = graph
+        return _label_graph
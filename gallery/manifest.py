@@ -0,0 +1,125 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+"""
+Load galleries from a JSON manifest file.
+
+The manifest is an object with a "replays" list used for the main gallery,
+and a "galleries" list of objects with an "image" and their own "replays" list.
+Galleries without a "replays" list share the replays of the main gallery.
+Replays are objects with the "image", "label", and "scope" keys, and optional "tags" and "hover_movie" keys;
+the scope is a name from the scope functions passed to the manifest.
+
+    {
+        "replays": [
+            {"image": "test.png", "label": "replay1", "scope": "default", "tags": ["example"]}
+        ],
+        "galleries": [
+            {"image": "test.png", "replays": [{"image": "test.png", "label": "replay2", "scope": "default"}]},
+            {"image": "test.png"}
+        ]
+    }
+
+The file is only read once the items are first accessed.
+"""
+
+from __future__ import unicode_literals
+
+import json
+import typing as t
+
+import renpy
+
+from . import PagedSequence
+
+__all__ = [
+    "GalleryManifest",
+]
+
+T = t.TypeVar("T")
+
+
+class _LazySequence(t.Generic[T]):
+    """Sequence whose items are created by `load` on first access."""
+
+    __slots__ = ("_load", "_items")
+
+    def __init__(self, load):
+        # type: (t.Callable[[], list[T]]) -> None
+        self._load = load
+        self._items = None  # type: list[T] | None
+
+    @property
+    def items(self):
+        # type: () -> list[T]
+        if self._items is None:
+            self._items = self._load()
+        return self._items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class GalleryManifest(object):
+    """
+    Galleries described by the manifest at `filename`.
+
+    Replay and gallery items are created with `replay_item_factory` and `gallery_item_factory`,
+    and paged into pages of `page_size` items.
+    """
+
+    def __init__(self, filename, replay_item_factory, gallery_item_factory, scope_functions, page_size):
+        # type: (t.Text, t.Callable[..., t.Any], t.Callable[..., t.Any], dict[t.Text, t.Callable], int) -> None
+        self.filename = filename
+        self._replay_item_factory = replay_item_factory
+        self._gallery_item_factory = gallery_item_factory
+        self._scope_functions = scope_functions
+        self._page_size = page_size
+        self._manifest = None  # type: dict | None
+
+        self.replay_items = PagedSequence(_LazySequence(self._load_replay_items), page_size)
+        self.galleries = PagedSequence(_LazySequence(self._load_galleries), page_size)
+
+    @property
+    def manifest(self):
+        # type: () -> dict
+        """The parsed manifest file, it's read on first access."""
+        if self._manifest is None:
+            with renpy.loader.load(self.filename) as file:
+                self._manifest = json.loads(file.read().decode("utf-8"))
+        return self._manifest
+
+    def _create_replay_items(self, replays):
+        # type: (list[dict]) -> list[t.Any]
+        return [
+            self._replay_item_factory(
+                replay["image"],
+                replay["label"],
+                self._scope_functions[replay["scope"]],
+                hover_movie=replay.get("hover_movie"),
+                tags=replay.get("tags", ()),
+            )
+            for replay in replays
+        ]
+
+    def _load_replay_items(self):
+        # type: () -> list[t.Any]
+        return self._create_replay_items(self.manifest.get("replays", []))
+
+    def _load_galleries(self):
+        # type: () -> list[t.Any]
+        return [
+            self._gallery_item_factory(
+                gallery["image"],
+                PagedSequence(self._create_replay_items(gallery["replays"]), self._page_size)
+                if "replays" in gallery
+                else self.replay_items,
+            )
+            for gallery in self.manifest.get("galleries", [])
+        ]
@@ -0,0 +1,180 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+"""
+Record snapshots of the game state at replay start points during normal play.
+
+A snapshot contains the store variables read by the replay's code and conditions,
+and the images shown on the master layer. Replays can be started with the snapshot
+to get the correct state without going through the setup code before the replay.
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import numbers
+import types
+import typing as t
+from itertools import islice
+
+import renpy
+import renpy.ast
+import renpy.game
+import renpy.python
+
+from .ast_utils import mark_node_patched, patch_after_node, walk_static_path
+
+__all__ = [
+    "SNAPSHOT_NODE_LIMIT",
+    "install_snapshot_recorders",
+    "get_snapshot",
+    "show_snapshot_images",
+]
+
+# Maximum number of nodes from the start of a replay that are searched for variables to record.
+SNAPSHOT_NODE_LIMIT = 2000
+
+_SCALAR_TYPES = (numbers.Number, type(""), type(b""), type(None))
+
+_label_variable_names = {}  # type: dict[t.Text, frozenset[t.Text]]
+
+
+class _SnapshotNode(renpy.ast.Node):
+    """Node that records the snapshot for the replay at `label_name` when executed."""
+
+    __slots__ = ("label_name",)
+
+    rollback = "never"
+
+    def __init__(self, loc, label_name):
+        # type: (tuple[t.Text, int], t.Text) -> None
+        super(_SnapshotNode, self).__init__(loc)
+        self.label_name = label_name
+
+    def diff_info(self):
+        return (_SnapshotNode, self.label_name)
+
+    def execute(self):
+        renpy.ast.next_node(self.next)
+        _record_snapshot(self.label_name)
+
+
+def install_snapshot_recorders(label_names):
+    # type: (t.Iterable[t.Text]) -> None
+    """
+    Patch in nodes that record snapshots for the replays at `label_names`.
+
+    The nodes are patched after the original node the replay label was created from,
+    so the artificial labels themselves skip them.
+    """
+    for label_name in label_names:
+        start_node = renpy.game.script.lookup(label_name)
+        original_node = renpy.game.script.namemap.get(start_node.name, start_node)
+
+        snapshot_node = _SnapshotNode((original_node.filename, original_node.linenumber), label_name)
+        snapshot_node.name = ("replay_snapshot_", label_name)
+        mark_node_patched(snapshot_node)
+        renpy.game.script.namemap[snapshot_node.name] = snapshot_node
+        patch_after_node(original_node, snapshot_node)
+
+
+def get_snapshot(label_name):
+    # type: (t.Text) -> tuple[dict[t.Text, object], tuple[t.Text, ...]] | None
+    """Get the recorded variables and shown images for the replay at `label_name`, or None if none were recorded."""
+    snapshots = renpy.game.persistent.replay_snapshots_
+    if snapshots is None:
+        return None
+    return snapshots.get(label_name)
+
+
+def show_snapshot_images(images):
+    # type: (t.Iterable[t.Text]) -> None
+    """Clear the master layer and show `images` on it."""
+    renpy.exports.scene()
+    for image_name in images:
+        renpy.exports.show(image_name)
+
+
+def _record_snapshot(label_name):
+    # type: (t.Text) -> None
+    """Store the snapshot of the current game state for the replay at `label_name` in persistent."""
+    if renpy.store._in_replay:
+        return
+
+    store_dict = vars(renpy.store)
+    variables = {
+        name: copy.deepcopy(store_dict[name])
+        for name in _variable_names(label_name)
+        if name in store_dict and _is_snapshot_value(store_dict[name])
+    }
+    images = tuple(
+        " ".join((tag,) + tuple(renpy.exports.get_attributes(tag)))
+        for tag in renpy.exports.get_showing_tags("master", sort=True)
+    )
+
+    snapshots = renpy.game.persistent.replay_snapshots_
+    if snapshots is None:
+        renpy.game.persistent.replay_snapshots_ = snapshots = {}
+    snapshots[label_name] = (variables, images)
+
+
+def _variable_names(label_name):
+    # type: (t.Text) -> frozenset[t.Text]
+    """Get the names read by code and conditions in the replay at `label_name`, the names are cached per label."""
+    names = _label_variable_names.get(label_name)
+    if names is not None:
+        return names
+
+    names = set()
+    start_node = renpy.game.script.lookup(label_name)
+    for node in islice(walk_static_path(start_node), SNAPSHOT_NODE_LIMIT):
+        if isinstance(node, renpy.ast.Python) and node.code.bytecode is not None:
+            names.update(_code_names(node.code.bytecode))
+            conditions = []
+        elif isinstance(node, renpy.ast.If):
+            conditions = [condition for condition, _ in node.entries]
+        elif isinstance(node, renpy.ast.While):
+            conditions = [node.condition]
+        elif isinstance(node, renpy.ast.Menu):
+            conditions = [condition for _, condition, _ in node.items]
+        else:
+            conditions = []
+
+        for condition in conditions:
+            names.update(_code_names(renpy.python.py_compile(condition, "eval")))
+
+    _label_variable_names[label_name] = names = frozenset(names)
+    return names
+
+
+def _code_names(code):
+    # type: (types.CodeType) -> set[t.Text]
+    """Get the global names used by `code`, including the names used by the code objects nested in it."""
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        # comprehensions, lambdas and functions are compiled into separate code objects
+        if isinstance(constant, types.CodeType):
+            names.update(_code_names(constant))
+    return names
+
+
+def _is_snapshot_value(value, _seen_ids=None):
+    # type: (object, set[int] | None) -> bool
+    """Return True if `value` is made up only of builtin scalars and containers, which are safe to persist."""
+    if isinstance(value, _SCALAR_TYPES):
+        return True
+    if not isinstance(value, (list, tuple, set, frozenset, dict)):
+        return False
+
+    if _seen_ids is None:
+        _seen_ids = set()
+    # containers that reference themselves are checked only once, their other elements decide the result
+    if id(value) in _seen_ids:
+        return True
+    _seen_ids.add(id(value))
+    if isinstance(value, dict):
+        return all(
+            _is_snapshot_value(key, _seen_ids) and _is_snapshot_value(element, _seen_ids)
+            for key, element in value.items()
+        )
+    return all(_is_snapshot_value(element, _seen_ids) for element in value)
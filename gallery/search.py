@@ -0,0 +1,73 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+from __future__ import unicode_literals
+
+import re
+import typing as t
+from collections import defaultdict
+
+from . import PagedSequence
+
+__all__ = [
+    "SearchIndex",
+]
+
+T = t.TypeVar("T")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class SearchIndex(t.Generic[T]):
+    """
+    Index of `items` for filtering them by the texts returned from `texts_function`.
+
+    Every word of the texts is indexed by all of its prefixes, an item matches a query
+    if all of the query's words are a prefix of one of the item's words.
+    The index is built on the first non-empty search.
+    """
+
+    def __init__(self, items, texts_function, page_size):
+        # type: (t.Sequence[T], t.Callable[[T], t.Iterable[t.Text]], int) -> None
+        self._items = items
+        self._texts_function = texts_function
+        self._page_size = page_size
+        self._prefix_index = None  # type: dict[t.Text, frozenset[int]] | None
+        self._last_query = None  # type: t.Text | None
+        self._last_result = PagedSequence(items, page_size)
+
+    def search(self, query):
+        # type: (t.Text) -> PagedSequence[T]
+        """Get the items matching `query` paged by the index's page size, the result of the last query is cached."""
+        if query == self._last_query:
+            return self._last_result
+
+        words = _WORD_RE.findall(query.lower())
+        if not words:
+            result = self._items
+        else:
+            if self._prefix_index is None:
+                self._build_index()
+            # longer words match fewer items, starting with them keeps the intersections small
+            positions = None  # type: set[int] | None
+            for word in sorted(words, key=len, reverse=True):
+                matches = self._prefix_index.get(word, frozenset())
+                positions = set(matches) if positions is None else positions.intersection(matches)
+                if not positions:
+                    break
+            result = [self._items[position] for position in sorted(positions)]
+
+        self._last_query = query
+        self._last_result = PagedSequence(result, self._page_size)
+        return self._last_result
+
+    def _build_index(self):
+        # type: () -> None
+        """Map all the prefixes of the items' words to positions of the items they're in."""
+        index = defaultdict(set)
+        for position, item in enumerate(self._items):
+            for text in self._texts_function(item):
+                for word in _WORD_RE.findall(text.lower()):
+                    for end in range(1, len(word) + 1):
+                        index[word[:end]].add(position)
+        self._prefix_index = {prefix: frozenset(positions) for prefix, positions in index.items()}
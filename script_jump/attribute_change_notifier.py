@@ -15,12 +15,24 @@ __all__ = [
 ]
 
 
+_NO_PENDING = object()
+
+
 class AttributeChangeNotifier(object):
-    """Descriptor for notifying about changes to the assigned attribute through callbacks."""
-    def __init__(self, name):
-        # type: (str) -> None
+    """
+    Descriptor for notifying about changes to the assigned attribute through callbacks.
+
+    If `defer_predicate` is passed, callbacks aren't called while it returns True,
+    and only the last deferred value is passed to them once `flush` is called.
+    Immediate callbacks are called with every value and the instance it's assigned to, even while deferring.
+    """
+    def __init__(self, name, defer_predicate=None):
+        # type: (str, t.Callable[[], bool] | None) -> None
         self._name = name
         self._callbacks = set()  # type: set[WeakMethod]
+        self._immediate_callbacks = set()  # type: set[WeakMethod]
+        self._defer_predicate = defer_predicate
+        self._pending = _NO_PENDING  # type: object
 
     def __get__(self, instance, owner=None):
         if instance is None:
@@ -29,23 +41,54 @@ class AttributeChangeNotifier(object):
         return vars(instance)[self._name]
 
     def __set__(self, instance, value):
-        for callback_ref in self._callbacks:
-            method = callback_ref()
-            if method:
-                method(value)
+        if self._immediate_callbacks:
+            for callback_ref in tuple(self._immediate_callbacks):
+                method = callback_ref()
+                if method:
+                    method(value, instance)
+
+        if self._defer_predicate is not None and self._defer_predicate():
+            self._pending = value
+        else:
+            self._pending = _NO_PENDING
+            self._notify(value)
 
         vars(instance)[self._name] = value
 
-    def add_callback(self, callback):
-        # type: (types.MethodType) -> None
+    def flush(self):
+        # type: () -> None
+        """Call the callbacks with the last value that was deferred, if there is one."""
+        if self._pending is not _NO_PENDING:
+            value = self._pending
+            self._pending = _NO_PENDING
+            self._notify(value)
+
+    def add_callback(self, callback, immediate=False):
+        # type: (types.MethodType, bool) -> None
         """
-        Add `callback` to the callbacks called on changes.
+        Add `callback` to the callbacks called on changes, `immediate` callbacks are never deferred.
 
-        A weak reference to the callback is kept.
+        Callbacks are called with the new value, immediate callbacks also with the instance it's assigned to.
+
+        A weak reference to the callback is kept, and removed once the callback's object is garbage collected.
         """
-        self._callbacks.add(WeakMethod(callback))
+        callbacks = self._immediate_callbacks if immediate else self._callbacks
+        callbacks.add(WeakMethod(callback, callbacks.discard))
 
     def remove_callback(self, callback):
         # type: (types.MethodType) -> None
         """Remove `callback` from the change callbacks."""
-        self._callbacks.remove(WeakMethod(callback))
+        callback_ref = WeakMethod(callback)
+        if callback_ref in self._immediate_callbacks:
+            self._immediate_callbacks.remove(callback_ref)
+        else:
+            self._callbacks.remove(callback_ref)
+
+    def _notify(self, value):
+        # type: (object) -> None
+        """Call all the callbacks with `value`."""
+        # dead references may be discarded from the set while it's iterated over
+        for callback_ref in tuple(self._callbacks):
+            method = callback_ref()
+            if method:
+                method(value)
@@ -0,0 +1,234 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+"""
+Record the nodes that were actually executed, and stream them to a trace file.
+
+The trace is a JSONL file, its first line is a header with the script's digest,
+and every following line is an executed node with its id in the script's control flow graph,
+its file and line number, and the monotonic time it was executed at.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import threading
+import time
+import traceback
+import typing as t
+from array import array
+
+import renpy
+
+from gallery.control_flow import control_flow_graph
+from script_jump.execution_tracing import node_notifier, set_tracing
+
+if t.TYPE_CHECKING:
+    from gallery.control_flow import ControlFlowGraph
+    from script_jump.attribute_change_notifier import AttributeChangeNotifier
+
+__all__ = [
+    "ExecutionRecorder",
+    "start_recording",
+    "stop_recording",
+    "recording",
+]
+
+# Number of events the ring buffer holds, has to be a power of two
+RECORDER_CAPACITY = 1 << 16
+# Seconds between the writer's flushes of the buffer to the file
+RECORDER_FLUSH_INTERVAL = 0.5
+
+
+class ExecutionRecorder(object):
+    """
+    Record executed nodes into a ring buffer of `capacity` events, that's written to `filename` by a writer thread.
+
+    Events are stored in preallocated arrays, so no objects are created per event on the game's thread,
+    the names of the nodes are only resolved to their ids by the writer.
+    If the writer falls behind by more than the capacity, the oldest events are dropped and their count is written
+    to the file instead.
+    If writing fails, the error is kept in `error` and the recorder is stopped on the next recorded event.
+    """
+
+    def __init__(self, filename, capacity=RECORDER_CAPACITY, flush_interval=RECORDER_FLUSH_INTERVAL):
+        # type: (t.Text, int, float) -> None
+        assert capacity & (capacity - 1) == 0, "capacity must be a power of two"
+        self.filename = filename
+        self._capacity = capacity
+        self._mask = capacity - 1
+        self._flush_interval = flush_interval
+        self._node_names = [None] * capacity  # type: list[object]
+        self._timestamps = array("d", [0.0]) * capacity
+        # total number of recorded and written events, the positions in the buffer are these modulo the capacity
+        self._write_index = 0
+        self._read_index = 0
+        self.dropped_count = 0
+        self.error = None  # type: Exception | None
+        self._graph = None  # type: ControlFlowGraph | None
+        self._notifier = None  # type: AttributeChangeNotifier | None
+        self._stop_event = threading.Event()
+        self._thread = None  # type: threading.Thread | None
+
+    @property
+    def recorded_count(self):
+        # type: () -> int
+        return self._write_index
+
+    @property
+    def running(self):
+        # type: () -> bool
+        return self._notifier is not None
+
+    def start(self):
+        # type: () -> None
+        """
+        Start recording executed nodes and writing them in the background.
+
+        The file is created and its header written before anything is recorded,
+        so errors from opening it are raised from here.
+        """
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        file = io.open(self.filename, "w", encoding="utf-8")
+        try:
+            header = {
+                "digest": renpy.game.script.digest.hexdigest(),
+                "capacity": self._capacity,
+                "clock": "monotonic",
+            }
+            file.write(json.dumps(header) + "\n")
+        except Exception:
+            file.close()
+            raise
+
+        self.error = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(file,), name="Execution trace writer")
+        self._thread.daemon = True
+        self._thread.start()
+        set_tracing(True, self)
+        self._notifier = node_notifier()
+        self._notifier.add_callback(self.record, immediate=True)
+
+    def stop(self):
+        # type: () -> None
+        """Stop recording, and wait for the writer to write the remaining events and close the file."""
+        if self._notifier is not None:
+            self._notifier.remove_callback(self.record)
+            self._notifier = None
+            set_tracing(False, self)
+
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def record(self, node_name, context):
+        # type: (object, renpy.execution.Context) -> None
+        """Record the execution of the node with the name `node_name` in `context`."""
+        if self.error is not None:
+            # nothing would write the events anymore
+            self.stop()
+            return
+        index = self._write_index
+        position = index & self._mask
+        self._node_names[position] = node_name
+        self._timestamps[position] = time.monotonic()
+        # the index is only advanced after the event is stored, so the writer never reads a partially stored event
+        self._write_index = index + 1
+
+    def _run(self, file):
+        # type: (t.TextIO) -> None
+        """Write the batches of recorded events to `file` until stopped, then close it."""
+        try:
+            with file:
+                # the graph is only needed to resolve the node ids, so it's loaded here instead of on the game's thread
+                self._graph = control_flow_graph()
+                while not self._stop_event.wait(self._flush_interval):
+                    self._write_batch(file)
+                self._write_batch(file)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+
+    def _write_batch(self, file):
+        # type: (t.TextIO) -> None
+        """Write the events recorded since the last batch to `file`."""
+        start = self._read_index
+        end = self._write_index
+        if end - start > self._capacity:
+            self._drop(file, end - start - self._capacity)
+            start = end - self._capacity
+
+        events = [
+            (self._node_names[index & self._mask], self._timestamps[index & self._mask]) for index in range(start, end)
+        ]
+        # events that the game's thread overwrote while they were being copied are dropped
+        overwritten_count = self._write_index - self._capacity - start
+        if overwritten_count > 0:
+            self._drop(file, overwritten_count)
+            events = events[overwritten_count:]
+
+        lines = []
+        namemap = renpy.game.script.namemap
+        for node_name, timestamp in events:
+            node = namemap.get(node_name)
+            node_id = self._graph.node_id(node) if node is not None else None
+            if node_id is None:
+                lines.append(json.dumps({"node": None, "time": timestamp}))
+            else:
+                node = self._graph.node(node_id)
+                lines.append(
+                    json.dumps({"node": node_id, "file": node.filename, "line": node.linenumber, "time": timestamp})
+                )
+        if lines:
+            file.write("\n".join(lines) + "\n")
+            file.flush()
+        self._read_index = end
+
+    def _drop(self, file, count):
+        # type: (t.TextIO, int) -> None
+        self.dropped_count += count
+        file.write(json.dumps({"dropped": count}) + "\n")
+
+
+_recorder = None  # type: ExecutionRecorder | None
+
+
+def start_recording(filename=None):
+    # type: (t.Text | None) -> ExecutionRecorder
+    """
+    Start recording executed nodes to `filename`, stopping the current recording if there is one.
+
+    The default file is a timestamped trace in the save directory.
+    """
+    global _recorder
+    stop_recording()
+    if filename is None:
+        filename = os.path.join(
+            renpy.config.savedir or renpy.config.basedir,
+            "execution_trace_{}.jsonl".format(time.strftime("%Y%m%d_%H%M%S")),
+        )
+    recorder = ExecutionRecorder(filename)
+    recorder.start()
+    _recorder = recorder
+    return recorder
+
+
+def stop_recording():
+    # type: () -> None
+    """Stop the current recording if there is one."""
+    global _recorder
+    if _recorder is not None:
+        _recorder.stop()
+        _recorder = None
+
+
+def recording():
+    # type: () -> bool
+    """Return True if executed nodes are being recorded, a recording stopped by a write error isn't."""
+    return _recorder is not None and _recorder.running
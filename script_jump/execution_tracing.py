@@ -3,63 +3,488 @@
 
 from __future__ import unicode_literals
 
+import threading
+import time
 import typing as t
-from collections import OrderedDict
+import weakref
+from array import array
+from collections import OrderedDict, deque
+from functools import partial
+from itertools import islice
 
 import renpy
 
-from gallery import grouper
-from script_jump.utils import NodeWrapper, cache
+from gallery import PagedSequence
+from gallery.control_flow import control_flow_graph, load_control_flow_graph_in_background
+from script_jump.ast_manipulation import executing_node
+from script_jump.utils import ContinuationMarkerWrapper, LoopMarkerWrapper, NodeWrapper, wrap_node
 from script_jump.attribute_change_notifier import AttributeChangeNotifier
 
+if t.TYPE_CHECKING:
+    from gallery.control_flow import ControlFlowGraph
 
 __all__ = [
-    "patch_context_notifier",
+    "node_notifier",
+    "set_tracing",
+    "tracing_enabled",
+    "logs_with_node",
+    "build_log_in_background",
+    "cancel_log_build",
+    "get_log",
+    "log_key",
+    "LOG_MEMORY_BUDGET",
     "NodeWrapper",
     "NodePathLog",
 ]
 
 _new_node_notifier = None  # type: AttributeChangeNotifier | None
+_MISSING = object()
+_original_context_current = _MISSING  # type: object
+# Owners that enabled tracing, the descriptor is patched in while there are any
+_tracing_owners = set()  # type: set[object]
+# Owner of the tracing of the logs
+_LOGS = "logs"
 
 NODE_PAGE_SIZE = 250
+# Maximum number of nodes in a log, longer paths are truncated with a continuation marker;
+# it's read when a log is created, so changing it applies to the logs created after the change
+NODE_BUDGET = 50000
+# Approximate memory in bytes the cached logs can use, least recently viewed logs are evicted over it;
+# it's read whenever the logs are trimmed, so changes apply from the next created or expanded log
+LOG_MEMORY_BUDGET = 64 * 1024 * 1024
+# Bytes used per node of a log by its node and label id arrays
+_LOG_ENTRY_SIZE = 8
+# Approximate bytes used per node of a log that's also in other logs, by its entry in the dispatcher's shared slots
+_SHARED_ENTRY_SIZE = 100
+
+
+class _LabelTable(object):
+    """
+    Global table of ids for label names.
 
+    Logs store the ids in arrays instead of keeping references to the names for every entry.
+    """
 
-def patch_context_notifier():
-    # type: () -> None
-    """Patch in Context's current variable to the ChangeNotify descriptor."""
+    def __init__(self):
+        self.label_names = []  # type: list[t.Text]
+        self._label_ids = {}  # type: dict[t.Text, int]
+        self._lock = threading.Lock()
+
+    def label_id(self, label_name):
+        # type: (t.Text | None) -> int
+        """Get the id of `label_name`, a new id is assigned if it doesn't have one. None has the id -1."""
+        if label_name is None:
+            return -1
+        label_id = self._label_ids.get(label_name)
+        if label_id is None:
+            with self._lock:
+                label_id = self._label_ids.get(label_name)
+                if label_id is None:
+                    label_id = self._label_ids[label_name] = len(self.label_names)
+                    self.label_names.append(label_name)
+        return label_id
+
+    def label_name(self, label_id):
+        # type: (int) -> t.Text | None
+        """Get the label name with the id `label_id`."""
+        if label_id == -1:
+            return None
+        return self.label_names[label_id]
+
+
+_label_table = _LabelTable()
+
+
+class _BitSet(object):
+    """Set of non-negative integers stored as bits."""
+
+    __slots__ = ("_bytes",)
+
+    def __init__(self):
+        self._bytes = bytearray()
+
+    @property
+    def byte_size(self):
+        # type: () -> int
+        return len(self._bytes)
+
+    def add(self, value):
+        # type: (int) -> None
+        byte_index = value >> 3
+        if byte_index >= len(self._bytes):
+            # grow geometrically so adding increasing values is amortized constant time
+            self._bytes.extend(bytearray(max(byte_index + 1, 2 * len(self._bytes)) - len(self._bytes)))
+        self._bytes[byte_index] |= 1 << (value & 7)
+
+    def __contains__(self, value):
+        # type: (int) -> bool
+        byte_index = value >> 3
+        return byte_index < len(self._bytes) and bool(self._bytes[byte_index] & (1 << (value & 7)))
+
+
+def _log_node_id(graph, node):
+    # type: (ControlFlowGraph, renpy.ast.Node) -> int | None
+    """Get the id of `node` in `graph`, None is returned for patched nodes as they're never in logs."""
+    if node.filename.startswith("patched"):
+        return None
+    return graph.node_id(node)
+
+
+class _NodeDispatcher(object):
+    """
+    Dispatch the executed nodes to the logs that contain them.
+
+    The node is resolved once for all the logs, and only the logs that contain it are updated.
+    Nodes are indexed by their id in the control flow graph and logs by a slot, the index is an array
+    of the slot of the first log containing every node of the script, and arrays of the slots of the other logs
+    for the nodes contained in multiple logs.
+    Logs may add their nodes from the builder thread, so changes to the index are done under a lock;
+    reads rely on single array, dict and list operations being atomic.
+    Logs that were garbage collected are queued for removal without taking the lock, as the collection can happen
+    on a thread that's already holding it, and are removed from the index on its next change.
+    """
+
+    def __init__(self):
+        self._graph = None  # type: ControlFlowGraph | None
+        self._first_logs = array("i")
+        self._shared_logs = {}  # type: dict[int, array[int]]
+        self._log_refs = []  # type: list[weakref.ref[NodePathLog] | None]
+        self._free_slots = []  # type: list[int]
+        self._lock = threading.Lock()
+        self._dead_logs = deque()  # type: deque[tuple[ControlFlowGraph, int, t.Sequence[int], weakref.ref]]
+
+    def dispatch(self, node_name):
+        # type: (t.Text) -> None
+        """Set the current node of all the logs containing the node with the name `node_name`."""
+        renpy_node = renpy.game.script.namemap.get(node_name)
+        if renpy_node is not None:
+            self.dispatch_node(renpy_node)
+
+    def dispatch_node(self, node):
+        # type: (renpy.ast.Node) -> None
+        """Set the current node of all the logs containing `node`."""
+        for log in self.logs_with_node(node):
+            log.set_current_node(node)
+
+    def logs_with_node(self, node):
+        # type: (renpy.ast.Node) -> list[NodePathLog]
+        """Get all the alive logs that contain `node`."""
+        graph = self._graph
+        if graph is None:
+            return []
+        node_id = _log_node_id(graph, node)
+        if node_id is None or node_id >= len(self._first_logs):
+            return []
+        first_slot = self._first_logs[node_id]
+        if first_slot == -1:
+            return []
+        shared_slots = self._shared_logs.get(node_id)
+        slots = [first_slot] + shared_slots.tolist() if shared_slots is not None else [first_slot]
+
+        logs = []
+        log_refs = self._log_refs
+        for slot in slots:
+            log_ref = log_refs[slot] if slot < len(log_refs) else None
+            log = log_ref() if log_ref is not None else None
+            if log is not None:
+                logs.append(log)
+        return logs
+
+    def register_log(self, log, graph, node_ids):
+        # type: (NodePathLog, ControlFlowGraph, t.Sequence[int]) -> int
+        """
+        Register `log` with the array of ids of its nodes from `graph`, `node_ids`.
+
+        Nodes from the array are removed from the index when the log is garbage collected.
+        The log's slot is returned, it should be passed to `add_nodes` with the log's nodes.
+        """
+        with self._lock:
+            self._remove_dead_logs()
+            if graph is not self._graph:
+                # the script changed, the logs of the previous script can't contain any of its nodes
+                self._graph = graph
+                self._first_logs = array("i", [-1]) * graph.node_count
+                self._shared_logs = {}
+                self._log_refs = []
+                self._free_slots = []
+
+            if self._free_slots:
+                slot = self._free_slots.pop()
+            else:
+                slot = len(self._log_refs)
+                self._log_refs.append(None)
+            self._log_refs[slot] = weakref.ref(log, partial(self._queue_dead_log, graph, slot, node_ids))
+            return slot
+
+    def add_nodes(self, graph, slot, node_ids):
+        # type: (ControlFlowGraph, int, t.Iterable[int]) -> int
+        """
+        Add the nodes with `node_ids` to the index for the log in `slot`.
+
+        The number of the nodes that were already in other logs is returned.
+        """
+        shared_count = 0
+        with self._lock:
+            self._remove_dead_logs()
+            if graph is not self._graph:
+                return 0
+            first_logs = self._first_logs
+            for node_id in node_ids:
+                if first_logs[node_id] == -1:
+                    first_logs[node_id] = slot
+                    continue
+                shared_slots = self._shared_logs.get(node_id)
+                if shared_slots is None:
+                    self._shared_logs[node_id] = array("i", [slot])
+                else:
+                    shared_slots.append(slot)
+                shared_count += 1
+        return shared_count
+
+    def unregister_log(self, graph, slot, node_ids):
+        # type: (ControlFlowGraph, int, t.Sequence[int]) -> None
+        """Remove the log in `slot` from the index entries of the nodes in `node_ids` before it's garbage collected."""
+        with self._lock:
+            self._remove_dead_logs()
+            if graph is self._graph:
+                self._remove_log(slot, node_ids)
+
+    def _queue_dead_log(self, graph, slot, node_ids, log_ref):
+        # type: (ControlFlowGraph, int, t.Sequence[int], weakref.ref[NodePathLog]) -> None
+        """Queue the log in `slot` referenced by the dead `log_ref` to be removed from the index."""
+        self._dead_logs.append((graph, slot, node_ids, log_ref))
+
+    def _remove_dead_logs(self):
+        # type: () -> None
+        """Remove the queued dead logs from the index, the lock must be held."""
+        while self._dead_logs:
+            graph, slot, node_ids, log_ref = self._dead_logs.popleft()
+            # the slot may have been unregistered and reused by another log since the log died
+            if graph is self._graph and self._log_refs[slot] is log_ref:
+                self._remove_log(slot, node_ids)
+
+    def _remove_log(self, slot, node_ids):
+        # type: (int, t.Sequence[int]) -> None
+        """Remove the log in `slot` from the index entries of the nodes in `node_ids`, the lock must be held."""
+        first_logs = self._first_logs
+        shared_logs = self._shared_logs
+        for node_id in node_ids:
+            shared_slots = shared_logs.get(node_id)
+            if first_logs[node_id] == slot:
+                if shared_slots is None:
+                    first_logs[node_id] = -1
+                    continue
+                first_logs[node_id] = shared_slots.pop()
+            elif shared_slots is not None and slot in shared_slots:
+                shared_slots.remove(slot)
+            else:
+                continue
+            if not shared_slots:
+                del shared_logs[node_id]
+        self._log_refs[slot] = None
+        self._free_slots.append(slot)
+
+
+_node_dispatcher = _NodeDispatcher()
+
+logs_with_node = _node_dispatcher.logs_with_node
+
+
+class _LogBuilder(object):
+    """
+    Expand the whole path of a log on a worker thread.
+
+    Only one log is built at a time, starting a build of another log cancels the current one.
+    The thread keeps a reference to the log it's building, so it can't be garbage collected while its index
+    entries are still being added.
+    """
+
+    def __init__(self):
+        self._log = None  # type: NodePathLog | None
+        self._cancel_event = None  # type: threading.Event | None
+
+    def build(self, log):
+        # type: (NodePathLog | None) -> None
+        """Start expanding the path of `log` in the background, or only cancel the current build if it's None."""
+        if log is self._log:
+            return
+        self.cancel()
+        if log is None or log.complete:
+            return
+
+        self._log = log
+        self._cancel_event = cancel_event = threading.Event()
+        thread = threading.Thread(target=self._run, args=(log, cancel_event), name="NodePathLog builder")
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self):
+        # type: () -> None
+        """Stop the current build, nodes expanded up to that point are kept in its log."""
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+        self._cancel_event = None
+        self._log = None
+
+    @staticmethod
+    def _run(log, cancel_event):
+        # type: (NodePathLog, threading.Event) -> None
+        while not cancel_event.is_set() and not log.complete:
+            log.expand_page()
+            _log_cache.trim()
+            # give up the GIL so the interaction loop isn't starved between pages
+            time.sleep(0)
+
+
+_log_builder = _LogBuilder()
+
+build_log_in_background = _log_builder.build
+cancel_log_build = _log_builder.cancel
+
+
+def _defer_node_notifications():
+    # type: () -> bool
+    """
+    Return True if the game is skipping or rolling back.
+
+    Executed nodes are only dispatched to the logs at the next interaction in that case.
+    """
+    return bool(renpy.config.skipping) or renpy.game.after_rollback
+
+
+def node_notifier():
+    # type: () -> AttributeChangeNotifier
+    """
+    Get the ChangeNotify descriptor for Context's current variable, which dispatches its changes to the logs.
+
+    Other callbacks can be added to it, they're only called while tracing is enabled.
+    """
     global _new_node_notifier
-    renpy.execution.Context.current = _new_node_notifier = AttributeChangeNotifier("current")
+    if _new_node_notifier is None:
+        _new_node_notifier = AttributeChangeNotifier("current", _defer_node_notifications)
+        _new_node_notifier.add_callback(_node_dispatcher.dispatch)
+        renpy.config.interact_callbacks.append(_new_node_notifier.flush)
+    return _new_node_notifier
+
+
+def tracing_enabled(owner=_LOGS):
+    # type: (object) -> bool
+    """Return True if tracing is enabled for `owner`, the default owner is the logs."""
+    return owner in _tracing_owners
+
+
+def set_tracing(enabled, owner=_LOGS):
+    # type: (bool, object) -> None
+    """
+    Enable or disable tracing of the executed nodes for `owner`, the default owner is the logs.
+
+    The descriptor is patched into Context's current variable while tracing is enabled for any owner,
+    and the original variable is restored once it's disabled for all of them.
+    Calls that don't change the state of `owner` do nothing.
+    Enabling the tracing of the logs starts loading the control flow graph their paths are taken from
+    in the background, so it's usually ready before the first log is created; disabling it cancels their build.
+    """
+    if enabled:
+        _tracing_owners.add(owner)
+        if owner == _LOGS:
+            load_control_flow_graph_in_background()
+    else:
+        _tracing_owners.discard(owner)
+        if owner == _LOGS:
+            cancel_log_build()
+    _sync_context_notifier()
+
+
+def _sync_context_notifier():
+    # type: () -> None
+    """
+    Patch in or restore Context's current variable if it doesn't match whether any owner enabled tracing.
+
+    The logs are synced to the executing node when it's patched in,
+    as it may have changed while the descriptor wasn't patched in.
+    """
+    global _original_context_current
+    notifier = node_notifier()
+    patched = vars(renpy.execution.Context).get("current") is notifier
+    if bool(_tracing_owners) == patched:
+        return
+
+    if _tracing_owners:
+        _original_context_current = vars(renpy.execution.Context).get("current", _MISSING)
+        renpy.execution.Context.current = notifier
+        if renpy.game.contexts:
+            node = executing_node()
+            if node is not None:
+                _node_dispatcher.dispatch_node(node)
+    elif _original_context_current is _MISSING:
+        del renpy.execution.Context.current
+    else:
+        renpy.execution.Context.current = _original_context_current
 
 
 def node_forkable(wrapped_node):
     # type: (NodeWrapper) -> bool
     """True if the wrapped node can be forked into child logs, False otherwise."""
-    return isinstance(wrapped_node.node, (renpy.ast.Menu, renpy.ast.If, renpy.ast.While))
+    return not wrapped_node.is_marker and isinstance(wrapped_node.node, (renpy.ast.Menu, renpy.ast.If, renpy.ast.While))
 
 
-@cache
 def forked_child_logs(wrapped_node):
     # type: (NodeWrapper) -> list[NodePathLog]
     """
     The child logs under this node.
 
-    The logs are cached after the first access.
-    """
-    if isinstance(wrapped_node.node, renpy.ast.Menu):
-        return [
-            NodePathLog(branch_nodes[0])
-            for (_, _, branch_nodes) in wrapped_node.node.items if branch_nodes is not None
-        ]
-    elif isinstance(wrapped_node.node, renpy.ast.If):
-        return [
-            NodePathLog(branch_nodes[0])
-            for (_, branch_nodes) in wrapped_node.node.entries if branch_nodes is not None
-        ]
-    elif isinstance(wrapped_node.node, renpy.ast.While):
-        # not a fork but creates a child
-        return [NodePathLog(wrapped_node.node.block[0])]
-    else:
+    The logs start at the node's branches in the control flow graph, a while's block is not a fork but a child.
+    They end at the point where the branches merge back together, so the path after it is only stored once
+    in the log continuing from there.
+    The logs are taken from the log cache, and may be rebuilt if they were evicted since the last access.
+    """
+    if not isinstance(wrapped_node.node, (renpy.ast.Menu, renpy.ast.If, renpy.ast.While)):
         raise RuntimeError("Node of type {!r} has no children.", type(wrapped_node.node).__name__)
+    graph = control_flow_graph()
+    merge_node = graph.merge_node(wrapped_node.node)
+    return [
+        get_log(branch_node, wrapped_node.label_name, (), merge_node)
+        for branch_node in graph.branch_nodes(wrapped_node.node)
+    ]
+
+
+class _LogNodes(object):
+    """
+    Sequence of the wrapped nodes of `log`.
+
+    The wrappers are only created for the accessed entries, and are shared with other logs through `wrap_node`.
+    The log is referenced through a proxy, so the log isn't kept in a reference cycle and is freed as soon as
+    it's evicted instead of by the cyclic garbage collector.
+    """
+
+    __slots__ = ("_log",)
+
+    def __init__(self, log):
+        # type: (NodePathLog) -> None
+        self._log = weakref.proxy(log)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._log._node_ids) + (self._log._end_marker is not None)
+
+    def __getitem__(self, index):
+        # type: (int | slice) -> NodeWrapper | list[NodeWrapper]
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[position] for position in range(start, stop, step)]
+            return self._log._wrappers(start, stop)
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("log index out of range")
+        return self._log._wrappers(index, index + 1)[0]
+
+    def __iter__(self):
+        # type: () -> t.Iterator[NodeWrapper]
+        for index in range(len(self)):
+            yield self[index]
 
 
 class NodePathLog(object):
@@ -67,82 +492,269 @@ class NodePathLog(object):
     Keeps track of execution starting from `node`.
 
     Static jumps and calls are resolved and seen as a part of its execution path.
+    The path is expanded lazily a page at a time as the pages are accessed through `page`,
+    `nodes` and `has_node` only cover the nodes that were expanded so far.
+
+    The nodes are stored as their ids in the script's control flow graph with their label ids in a parallel array,
+    and wrappers are only created for the accessed nodes.
+
+    If the path loops back to a node it already went through, it ends with a loop marker.
+    Paths longer than `node_budget`, `NODE_BUDGET` at the time the log is created by default,
+    are truncated and end with a continuation marker,
+    the log continuing from it can be created from the marker's node, label name and call stack.
+    If `end_node` is reached outside of any calls made in the path, the path ends with a continuation marker
+    at it instead; forked branches end at their merge point this way, and share the log continuing from it.
+    Closed logs stop expanding and are no longer updated with the executed node.
+    `label_name` and `call_stack` are the label and call stack the path starts in.
+
+    Creating a log takes time proportional to the page size, except for the first log of a script.
+    That one waits for the script's control flow graph to be loaded or built, which takes time proportional
+    to the script's size and is started in the background when tracing is enabled, and allocates the dispatcher's
+    index with an entry for every node of the script.
     """
 
-    def __init__(self, start_node):
-        # type: (renpy.ast.Node) -> None
-        assert _new_node_notifier is not None
-        _new_node_notifier.add_callback(self.update_from_new_node)
-
-        self._node_to_wrapper = {}  # type: dict[renpy.ast.Node, NodeWrapper]
-        self._nodes = []  # type: list[NodeWrapper]
-        self._paged_nodes = None
-        self.current_node = None
-        self._populate_nodes(start_node)
+    def __init__(self, start_node, label_name=None, call_stack=(), end_node=None, node_budget=None):
+        # type: (renpy.ast.Node, t.Text | None, t.Iterable[tuple], renpy.ast.Node | None, int | None) -> None
+        if node_budget is None:
+            node_budget = NODE_BUDGET
+        self._graph = control_flow_graph()
+        self._node_ids = array("i")
+        self._label_ids = array("i")
+        self._node_id_set = _BitSet()
+        self._shared_count = 0
+        self._end_marker = None  # type: NodeWrapper | None
+        self._nodes = _LogNodes(self)
+        self._paged_nodes = PagedSequence(self._nodes, NODE_PAGE_SIZE)
+        self._path = self._path_nodes(
+            self._graph, start_node, label_name, call_stack, end_node, node_budget
+        )  # type: t.Iterator[tuple[int, t.Text | None, NodeWrapper | None]] | None
+        self.current_node = None  # type: NodeWrapper | None
+        # the arguments the log can be recreated with
+        self.key = log_key(start_node, label_name, call_stack, end_node)
+        # the path can be consumed from the main thread and the builder thread
+        self._path_lock = threading.Lock()
+
+        self._dispatcher_slot = _node_dispatcher.register_log(self, self._graph, self._node_ids)
+        self._expand_path(NODE_PAGE_SIZE)
 
     @property
     def nodes(self):
-        # type: () -> list[NodeWrapper]
-        """Get a dict view of the wrapped nodes in this log."""
+        # type: () -> t.Sequence[NodeWrapper]
+        """Get the sequence of the wrapped nodes in this log."""
         return self._nodes
 
     @property
     def paged_nodes(self):
-        # type: () -> tuple[tuple[NodeWrapper, ...], ...]
-        """Nodes paged into tuples of `NODE_PAGE_SIZE` elements, last tuple may be smaller."""
-        if self._paged_nodes is None:
-            self._paged_nodes = grouper(self.nodes, NODE_PAGE_SIZE)
+        # type: () -> PagedSequence[NodeWrapper]
+        """Wrapped nodes paged into lists of `NODE_PAGE_SIZE` elements, last list may be smaller."""
         return self._paged_nodes
 
-    def update_from_new_node(self, node_name):
-        # type: (t.Text) -> None
-        """Change the current index to point to the node with the name `node_name`, if it is in this execution path."""
-        renpy_node = renpy.game.script.namemap.get(node_name)
-        if renpy_node is not None and not renpy_node.filename.startswith("patched"):
-            wrapped_node = self._node_to_wrapper.get(renpy_node)
-            if wrapped_node is not None:
-                self.current_node = wrapped_node
+    @property
+    def complete(self):
+        # type: () -> bool
+        """True if the whole path was expanded, False otherwise."""
+        return self._path is None
+
+    @property
+    def approximate_size(self):
+        # type: () -> int
+        """Approximate memory used by the log's nodes in bytes."""
+        return (
+            len(self._node_ids) * _LOG_ENTRY_SIZE
+            + self._shared_count * _SHARED_ENTRY_SIZE
+            + self._node_id_set.byte_size
+        )
+
+    def close(self):
+        # type: () -> None
+        """Stop expanding the path and remove the log's nodes from the dispatcher's index."""
+        with self._path_lock:
+            self._path = None
+        _node_dispatcher.unregister_log(self._graph, self._dispatcher_slot, self._node_ids)
+
+    def page(self, index):
+        # type: (int) -> list[NodeWrapper]
+        """
+        Get the page at `index` from `paged_nodes`.
+
+        The path is expanded up to the end of the page after it, so paging forward from the last page can continue.
+        """
+        self._expand_path((index + 2) * NODE_PAGE_SIZE)
+        return self._paged_nodes[index]
+
+    def expand_page(self):
+        # type: () -> None
+        """Expand the path by the nodes of the next page."""
+        self._expand_path(len(self._nodes) + NODE_PAGE_SIZE)
+
+    def set_current_node(self, node):
+        # type: (renpy.ast.Node) -> None
+        """Change the current node to the wrapper of `node`, if it is in this execution path."""
+        if self.has_node(node):
+            self.current_node = wrap_node(node, None, None)
 
     def has_node(self, node):
         # type: (renpy.ast.Node) -> bool
-        """Return True if the passed in node is a node in this path, False otherwise."""
-        return node in self._node_to_wrapper
-
-    def _populate_nodes(self, start_node):
-        # type: (renpy.ast.Node) -> None
-        """Populate `self._nodes` with all the nodes directly reachable from `start_node`."""
-        node = start_node
-        call_stack = []
-        current_label_name = None
+        """Return True if the passed in node is an expanded node in this path, False otherwise."""
+        node_id = _log_node_id(self._graph, node)
+        return node_id is not None and node_id in self._node_id_set
+
+    def _wrappers(self, start, stop):
+        # type: (int, int) -> list[NodeWrapper]
+        """Get the wrappers of the entries from `start` to `stop`."""
+        node_count = len(self._node_ids)
+        wrappers = []
         previous_wrapper = None
-
-        while True:
-            if (
-                isinstance(node, (renpy.ast.Translate, renpy.ast.EndTranslate, renpy.ast.Init))
-                or node.filename.startswith("patched")
-            ):
-                node = node.next
+        if 0 < start <= node_count:
+            previous_wrapper = self._wrap_entry(start - 1, None)
+        for position in range(start, min(stop, node_count)):
+            previous_wrapper = self._wrap_entry(position, previous_wrapper)
+            wrappers.append(previous_wrapper)
+        if stop > node_count and self._end_marker is not None:
+            wrappers.append(self._end_marker)
+        return wrappers
+
+    def _wrap_entry(self, position, previous_wrapper):
+        # type: (int, NodeWrapper | None) -> NodeWrapper
+        return wrap_node(
+            self._graph.node(self._node_ids[position]),
+            previous_wrapper,
+            _label_table.label_name(self._label_ids[position]),
+        )
+
+    def _expand_path(self, node_count):
+        # type: (int) -> None
+        """Expand nodes from the path until there are `node_count` entries, or the path ends."""
+        with self._path_lock:
+            if self._path is None or len(self._nodes) >= node_count:
+                return
+
+            start = len(self._node_ids)
+            for node_id, label_name, marker in islice(self._path, node_count - len(self._nodes)):
+                if marker is not None:
+                    self._end_marker = marker
+                    continue
+                # the id is added to the set before the array so anything reading the array can find it in the set
+                self._node_id_set.add(node_id)
+                self._label_ids.append(_label_table.label_id(label_name))
+                self._node_ids.append(node_id)
+
+            if self._end_marker is not None or len(self._nodes) < node_count:
+                self._path = None
+            self._shared_count += _node_dispatcher.add_nodes(
+                self._graph, self._dispatcher_slot, self._node_ids[start:]
+            )
+
+    @staticmethod
+    def _path_nodes(
+        graph,  # type: ControlFlowGraph
+        start_node,  # type: renpy.ast.Node
+        label_name,  # type: t.Text | None
+        call_stack,  # type: t.Iterable[tuple]
+        end_node,  # type: renpy.ast.Node | None
+        node_budget,  # type: int
+    ):  # type: (...) -> t.Iterator[tuple[int, t.Text | None, NodeWrapper | None]]
+        """
+        Yield the ids of all the nodes directly reachable from `start_node` with the name of the label they're under.
+
+        The nodes are taken from the static path through `graph`.
+        The third element of the yielded tuples is None for nodes on the path.
+        The path ends with a loop marker when a node is reached again with the same call stack,
+        or with a continuation marker once `node_budget` nodes were yielded or `end_node` was reached.
+        """
+        call_stack = list(call_stack)
+        start_depth = len(call_stack)
+        current_label_name = label_name
+        # states outside of calls, which are most of them, are kept as node ids in a bitset
+        seen_top_level_nodes = _BitSet()
+        seen_called_states = set()
+        seen_count = 0
+
+        graph_path = graph.static_path(start_node, tuple(saved_node for saved_node, _ in call_stack))
+        # the graph's call stack is a tuple of the call nodes, usable as a key
+        # so a node reached again from a different call isn't seen as a loop
+        for node, call_stack_key in graph_path:
+            if len(call_stack_key) > len(call_stack):
+                call_stack.append((call_stack_key[-1], current_label_name))
+            while len(call_stack_key) < len(call_stack):
+                _, current_label_name = call_stack.pop()
+
+            if isinstance(node, (renpy.ast.Translate, renpy.ast.EndTranslate, renpy.ast.Init)):
                 continue
 
             if isinstance(node, renpy.ast.Label):
                 current_label_name = node.name
 
-            self._node_to_wrapper[node] = previous_wrapper = NodeWrapper(node, previous_wrapper, current_label_name)
-            self._nodes.append(previous_wrapper)
+            node_id = graph.node_id(node)
+            if call_stack_key:
+                seen = (node_id, call_stack_key) in seen_called_states
+            else:
+                seen = node_id in seen_top_level_nodes
+            if seen:
+                yield node_id, current_label_name, LoopMarkerWrapper(node, None, current_label_name)
+                return
+            if seen_count >= node_budget or (node is end_node and len(call_stack) == start_depth):
+                marker = ContinuationMarkerWrapper(node, None, current_label_name, list(call_stack))
+                yield node_id, current_label_name, marker
+                return
+            if call_stack_key:
+                seen_called_states.add((node_id, call_stack_key))
+            else:
+                seen_top_level_nodes.add(node_id)
+            seen_count += 1
 
-            if isinstance(node, renpy.ast.Call) and not node.expression:
-                call_stack.append((node, current_label_name))
-                node = renpy.game.script.lookup(node.label)
+            yield node_id, current_label_name, None
 
-            elif node.next is not None:
-                node = node.next
 
-            elif isinstance(node, renpy.ast.Jump) and not node.expression:
-                node = renpy.game.script.lookup(node.target)
+def log_key(start_node, label_name=None, call_stack=(), end_node=None):
+    # type: (renpy.ast.Node, t.Text | None, t.Iterable[tuple], renpy.ast.Node | None) -> tuple
+    """Get the key of the log created with the passed arguments, the key's elements can be passed to `get_log`."""
+    return start_node, label_name, tuple(call_stack), end_node
 
-            elif call_stack:
-                saved_node, current_label_name = call_stack.pop()
-                node = saved_node.next
 
-            else:
-                break
+class _LogCache(object):
+    """
+    Logs keyed by the arguments they were created with.
+
+    When the logs use more than `memory_budget` bytes, the least recently accessed logs are closed and dropped
+    from the cache until they fit, the most recently accessed log is always kept.
+    If `memory_budget` is None, `LOG_MEMORY_BUDGET` is read every time the cache is trimmed.
+    """
+
+    def __init__(self, memory_budget=None):
+        # type: (int | None) -> None
+        self.memory_budget = memory_budget
+        self._logs = OrderedDict()  # type: OrderedDict[tuple, NodePathLog]
+        # the builder thread trims the cache as the log it's building grows
+        self._lock = threading.RLock()
+
+    def get(self, start_node, label_name=None, call_stack=(), end_node=None):
+        # type: (renpy.ast.Node, t.Text | None, t.Iterable[tuple], renpy.ast.Node | None) -> NodePathLog
+        """Get the log created with the passed arguments, creating it if it isn't in the cache."""
+        key = log_key(start_node, label_name, call_stack, end_node)
+        with self._lock:
+            log = self._logs.get(key)
+            if log is not None:
+                self._logs.move_to_end(key)
+                return log
+
+            log = NodePathLog(start_node, label_name, call_stack, end_node)
+            self._logs[log.key] = log
+            self.trim()
+            return log
+
+    def trim(self):
+        # type: () -> None
+        """Evict the least recently accessed logs until the logs fit into the memory budget."""
+        memory_budget = LOG_MEMORY_BUDGET if self.memory_budget is None else self.memory_budget
+        with self._lock:
+            size = sum(log.approximate_size for log in self._logs.values())
+            while size > memory_budget and len(self._logs) > 1:
+                _, log = self._logs.popitem(last=False)
+                size -= log.approximate_size
+                log.close()
+
+
+_log_cache = _LogCache()
+
+get_log = _log_cache.get
@@ -0,0 +1,315 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+"""
+Deterministic profiler of the script's nodes and labels.
+
+Every node transition seen by the Context.current notifier is timestamped, and the time since the previous
+transition is attributed to the previous node under the stack of labels it was executed in.
+Time spent waiting in interactions isn't counted, so say and menu nodes don't take all the time.
+"""
+
+from __future__ import unicode_literals
+
+import functools
+import io
+import os
+import time
+import typing as t
+from collections import defaultdict
+
+import renpy
+import renpy.display.core
+
+from script_jump.execution_tracing import node_notifier, set_tracing
+
+if t.TYPE_CHECKING:
+    from script_jump.attribute_change_notifier import AttributeChangeNotifier
+
+__all__ = [
+    "ProfileEntry",
+    "ScriptProfiler",
+    "start_profiling",
+    "stop_profiling",
+    "profiling",
+    "current_profiler",
+]
+
+
+class ProfileEntry(object):
+    """Total time in seconds and count of the executions attributed to a node or label under `name`."""
+
+    __slots__ = ("name", "total_time", "count")
+
+    def __init__(self, name, total_time, count):
+        # type: (t.Text, float, int) -> None
+        self.name = name
+        self.total_time = total_time
+        self.count = count
+
+    @property
+    def mean_time(self):
+        # type: () -> float
+        return self.total_time / self.count if self.count else 0.0
+
+
+class ScriptProfiler(object):
+    """
+    Attribute the time between node transitions to the nodes and their label stacks.
+
+    Every context on the context stack has its own label stack, which is kept in sync with the depth
+    of the context's return stack, so labels entered through calls are nested under the label they were called from.
+    The label stacks of nested contexts are nested under the stack of the context they were created from.
+    Timing is paused while an interaction runs, and resumed for the same node once it ends.
+    """
+
+    def __init__(self):
+        # (label stack, node name) -> [total time, count]
+        self._times = defaultdict(lambda: [0.0, 0])  # type: defaultdict[tuple[tuple[t.Text, ...], object], list]
+        # contexts from the context stack with their label stacks, in the order they were entered
+        self._contexts = []  # type: list[renpy.execution.Context]
+        self._label_stacks = []  # type: list[list[t.Text | None]]
+        self._stack_key = ()  # type: tuple[t.Text | None, ...]
+        self._node_name = None  # type: object
+        self._last_time = None  # type: float | None
+        self._interaction_depth = 0
+        self._notifier = None  # type: AttributeChangeNotifier | None
+
+    @property
+    def running(self):
+        # type: () -> bool
+        return self._notifier is not None
+
+    def start(self):
+        # type: () -> None
+        """Start profiling node transitions."""
+        _patch_interact()
+        set_tracing(True, self)
+        self._notifier = node_notifier()
+        self._notifier.add_callback(self.transition, immediate=True)
+
+    def stop(self):
+        # type: () -> None
+        """Stop profiling, the collected times are kept."""
+        self.pause()
+        if self._notifier is not None:
+            self._notifier.remove_callback(self.transition)
+            self._notifier = None
+            set_tracing(False, self)
+        self._contexts = []
+        self._label_stacks = []
+
+    def transition(self, node_name, context):
+        # type: (object, renpy.execution.Context) -> None
+        """
+        Attribute the time since the last transition to the previous node, and start timing `node_name`.
+
+        `context` is the context the node is executed in, the node is counted under its label stack.
+        """
+        now = time.perf_counter()
+        if self._last_time is not None:
+            self._times[self._stack_key, self._node_name][0] += now - self._last_time
+
+        if self._sync_label_stacks(context, node_name):
+            self._stack_key = tuple(label_name for label_stack in self._label_stacks for label_name in label_stack)
+        self._node_name = node_name
+        self._times[self._stack_key, node_name][1] += 1
+        self._last_time = time.perf_counter()
+
+    def _sync_label_stacks(self, context, node_name):
+        # type: (renpy.execution.Context, object) -> bool
+        """
+        Sync the label stacks with the context stack and the return stack of `context`.
+
+        The label at the top of the context's stack is set if `node_name` is a label.
+        Return True if any of the stacks changed.
+        """
+        changed = False
+        contexts = self._contexts
+        if not contexts or contexts[-1] is not context:
+            context_stack = renpy.game.contexts
+            # a context that's not on the context stack yet is being created on top of it
+            level = next((index for index, entry in enumerate(context_stack) if entry is context), len(context_stack))
+            entered_contexts = list(context_stack[:level])
+            entered_contexts.append(context)
+            kept_count = 0
+            for kept_context, entered_context in zip(contexts, entered_contexts):
+                if kept_context is not entered_context:
+                    break
+                kept_count += 1
+            del contexts[kept_count:]
+            del self._label_stacks[kept_count:]
+            for entered_context in entered_contexts[kept_count:]:
+                contexts.append(entered_context)
+                self._label_stacks.append([None])
+            changed = True
+
+        label_stack = self._label_stacks[-1]
+        depth = len(getattr(context, "return_stack", ())) + 1
+        if depth != len(label_stack):
+            # the called label's name is set once its label node is executed
+            del label_stack[depth:]
+            label_stack.extend([None] * (depth - len(label_stack)))
+            changed = True
+        node = renpy.game.script.namemap.get(node_name)
+        if isinstance(node, renpy.ast.Label) and label_stack[-1] != node.name:
+            label_stack[-1] = node.name
+            changed = True
+        return changed
+
+    def pause(self):
+        # type: () -> None
+        """Attribute the time until now to the current node, and stop timing it until the interaction ends."""
+        if self._last_time is not None:
+            self._times[self._stack_key, self._node_name][0] += time.perf_counter() - self._last_time
+            self._last_time = None
+
+    def interaction_started(self):
+        # type: () -> None
+        self._interaction_depth += 1
+        self.pause()
+
+    def interaction_ended(self):
+        # type: () -> None
+        """Continue timing the current node, unless the interaction was nested in another one."""
+        self._interaction_depth -= 1
+        if self._interaction_depth == 0 and self.running:
+            self._last_time = time.perf_counter()
+
+    def node_entries(self):
+        # type: () -> list[ProfileEntry]
+        """Get the time spent in every node, summed over all the label stacks it was executed under."""
+        totals = defaultdict(lambda: [0.0, 0])
+        for (_, node_name), (total_time, count) in self._times.items():
+            total = totals[node_name]
+            total[0] += total_time
+            total[1] += count
+        return [
+            ProfileEntry(_node_description(node_name), total_time, count)
+            for node_name, (total_time, count) in totals.items()
+        ]
+
+    def label_entries(self):
+        # type: () -> list[ProfileEntry]
+        """Get the time spent in every label, including the time in the labels it called."""
+        totals = defaultdict(lambda: [0.0, 0])
+        for (stack_key, _), (total_time, count) in self._times.items():
+            # recursive calls count the time only once for the label
+            for label_name in set(stack_key):
+                total = totals[label_name]
+                total[0] += total_time
+                total[1] += count
+        return [
+            ProfileEntry(_label_description(label_name), total_time, count)
+            for label_name, (total_time, count) in totals.items()
+        ]
+
+    def collapsed_stacks(self):
+        # type: () -> list[t.Text]
+        """
+        Get the profile in the collapsed stack format used by flame graph tools.
+
+        Every line is a stack of labels ending with the node, and the time spent in it in microseconds.
+        """
+        lines = []
+        for (stack_key, node_name), (total_time, _) in sorted(self._times.items(), key=lambda item: item[1][0]):
+            frames = [_label_description(label_name) for label_name in stack_key]
+            frames.append(_node_description(node_name))
+            # semicolons separate the frames in the format
+            lines.append(
+                "{} {}".format(";".join(frame.replace(";", ",") for frame in frames), int(total_time * 1000000))
+            )
+        return lines
+
+    def export(self, filename):
+        # type: (t.Text) -> None
+        """Write the collapsed stacks to `filename`."""
+        with io.open(filename, "w", encoding="utf-8") as file:
+            file.write("\n".join(self.collapsed_stacks()) + "\n")
+
+
+def _node_description(node_name):
+    # type: (object) -> t.Text
+    """Describe the node with `node_name` by its type and location."""
+    node = renpy.game.script.namemap.get(node_name)
+    if node is None:
+        return "<no node>"
+    return "{} {}:{}".format(type(node).__name__, node.filename, node.linenumber)
+
+
+def _label_description(label_name):
+    # type: (t.Text | None) -> t.Text
+    return "<no label>" if label_name is None else label_name
+
+
+def _patch_interact():
+    # type: () -> None
+    """
+    Patch Interface.interact to pause the running profiler while an interaction runs.
+
+    The patch is kept after profiling stops, as it does nothing without a running profiler.
+    """
+    interface_class = renpy.display.core.Interface
+    interact = interface_class.interact
+    if getattr(interact, "_profiler_patched", False):
+        return
+
+    @functools.wraps(interact)
+    def profiled_interact(self, *args, **kwargs):
+        profiler = _profiler
+        if profiler is None or not profiler.running:
+            return interact(self, *args, **kwargs)
+        profiler.interaction_started()
+        try:
+            return interact(self, *args, **kwargs)
+        finally:
+            profiler.interaction_ended()
+
+    profiled_interact._profiler_patched = True
+    interface_class.interact = profiled_interact
+
+
+_profiler = None  # type: ScriptProfiler | None
+
+
+def start_profiling():
+    # type: () -> ScriptProfiler
+    """Start a new profile, the previous profile is discarded."""
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = ScriptProfiler()
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiling(filename=None):
+    # type: (t.Text | None) -> t.Text | None
+    """
+    Stop profiling and export the collapsed stacks to `filename`, the profile is kept for `current_profiler`.
+
+    The default file is a timestamped file in the save directory. The name of the written file is returned,
+    or None if nothing was being profiled.
+    """
+    if _profiler is None or not profiling():
+        return None
+    _profiler.stop()
+    if filename is None:
+        filename = os.path.join(
+            renpy.config.savedir or renpy.config.basedir,
+            "script_profile_{}.folded".format(time.strftime("%Y%m%d_%H%M%S")),
+        )
+    _profiler.export(filename)
+    return filename
+
+
+def profiling():
+    # type: () -> bool
+    """Return True if the script is being profiled."""
+    return _profiler is not None and _profiler.running
+
+
+def current_profiler():
+    # type: () -> ScriptProfiler | None
+    """Get the running or the last stopped profiler."""
+    return _profiler
@@ -6,7 +6,9 @@ from __future__ import unicode_literals
 import functools
 import re
 import sys
+import threading
 import typing as t
+import weakref
 from functools import partial
 
 import pygame.scrap
@@ -24,6 +26,9 @@ if t.TYPE_CHECKING:
 
 __all__ = [
     "NodeWrapper",
+    "wrap_node",
+    "LoopMarkerWrapper",
+    "ContinuationMarkerWrapper",
     "NoRollbackValue",
     "LogWrapper",
     "cache",
@@ -58,7 +63,10 @@ class NodeWrapper(t.Generic[_NodeT]):
     The wrapper allows NodePathLogs to be created from its children,
     and provides a string representation with its line from the file.
     """
-    __slots__ = ("node", "_line", "label_name", "previous_wrapper")
+    __slots__ = ("node", "_line", "label_name", "previous_wrapper", "__weakref__")
+
+    # Markers are entries in logs that aren't a node in the log's path themselves
+    is_marker = False
 
     def __init__(self, node, previous_wrapper, label_name):
         # type: (_NodeT, "NodeWrapper | None", t.Text | None) -> None
@@ -90,20 +98,87 @@ class NodeWrapper(t.Generic[_NodeT]):
         return self._line
 
 
+_wrapper_pool = weakref.WeakValueDictionary()  # type: weakref.WeakValueDictionary[renpy.ast.Node, NodeWrapper]
+_wrapper_pool_lock = threading.Lock()
+
+
+def wrap_node(node, previous_wrapper, label_name):
+    # type: (_NodeT, NodeWrapper | None, t.Text | None) -> NodeWrapper[_NodeT]
+    """
+    Get the wrapper of `node` shared by all logs, creating it if it doesn't exist.
+
+    If the existing wrapper is missing its previous wrapper or label name, they're filled in from the arguments.
+    """
+    with _wrapper_pool_lock:
+        wrapper = _wrapper_pool.get(node)
+        if wrapper is None:
+            _wrapper_pool[node] = wrapper = NodeWrapper(node, previous_wrapper, label_name)
+        else:
+            if wrapper.previous_wrapper is None and previous_wrapper is not None:
+                wrapper.previous_wrapper = previous_wrapper
+                # the line may depend on the previous node
+                wrapper._line = None
+            if wrapper.label_name is None:
+                wrapper.label_name = label_name
+    return wrapper
+
+
+class LoopMarkerWrapper(NodeWrapper[_NodeT]):
+    """Mark that a log's path loops back to the wrapped node."""
+    __slots__ = ()
+
+    is_marker = True
+
+    def __str__(self):
+        return "{:<15} {}".format("Loops to", self.line_string)
+
+
+class ContinuationMarkerWrapper(NodeWrapper[_NodeT]):
+    """
+    Mark that a log was truncated, and its path continues at the wrapped node.
+
+    The call stack of the path at the node is kept so logs can be continued from it.
+    """
+    __slots__ = ("call_stack",)
+
+    is_marker = True
+
+    def __init__(self, node, previous_wrapper, label_name, call_stack):
+        # type: (_NodeT, "NodeWrapper | None", t.Text | None, list[tuple[renpy.ast.Node, t.Text | None]]) -> None
+        super(ContinuationMarkerWrapper, self).__init__(node, previous_wrapper, label_name)
+        self.call_stack = call_stack
+
+    def __str__(self):
+        return "{:<15} {}".format("Continues at", self.line_string)
+
+
 class LogWrapper(object):
-    """Wrap a `NodePathLog` and the parent log it came from."""
+    """
+    Wrap a `NodePathLog` and the parent log it came from.
 
-    def __init__(self, parent, log):
-        # type: (NodePathLog | None, NodePathLog) -> None
+    The log is got from `get_log` on every access, so it can be rebuilt after it was evicted from the log cache.
+    """
+
+    def __init__(self, parent, get_log):
+        # type: (LogWrapper | None, t.Callable[[], NodePathLog]) -> None
         self.parent = parent
-        self.log = log
+        # number of forks and continuations from a log started at an executing node
+        self.depth = 0 if parent is None else parent.depth + 1
+        self._get_log = get_log
         self.page_index = 0
+        # the title is kept so listing the logs doesn't need to rebuild them
+        self.title = str(next(iter(get_log().nodes)))
+
+    @property
+    def log(self):
+        # type: () -> NodePathLog
+        return self._get_log()
 
     @property
     def current_page(self):
-        # type: () -> tuple[NodeWrapper, ...]
-        """Get the tuple of the current page."""
-        return self.log.paged_nodes[self.page_index]
+        # type: () -> list[NodeWrapper]
+        """Get the list of nodes on the current page."""
+        return self.log.page(self.page_index)
 
 
 _KEYWORD_SEP_SENTINEL = object()
@@ -0,0 +1,16 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+from __future__ import unicode_literals
+
+import os
+import sys
+
+_TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.dirname(_TESTS_DIRECTORY))
+try:
+    import renpy  # noqa: F401
+except ImportError:
+    # run against the stubs outside of Ren'Py, they only cover what the tests use
+    sys.path.insert(0, os.path.join(_TESTS_DIRECTORY, "stubs"))
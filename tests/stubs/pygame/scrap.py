@@ -0,0 +1,8 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+SCRAP_TEXT = "text/plain"
+
+
+def put(type, data):
+    pass
@@ -0,0 +1,10 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+"""
+Minimal stand-in for the parts of Ren'Py the tested modules use, only importable when Ren'Py itself isn't.
+
+Only the attributes and node types accessed at import time and by the tests are provided.
+"""
+
+from . import ast, config, defaultstore, display, execution, game, loader, python, sl2, store  # noqa: F401
@@ -0,0 +1,119 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+from __future__ import unicode_literals
+
+
+class Node(object):
+    def __init__(self, loc):
+        self.filename, self.linenumber = loc
+        self.name = None
+        self.next = None
+
+    def chain(self, next):
+        self.next = next
+
+
+class Label(Node):
+    def __init__(self, loc, name, block, parameters):
+        super(Label, self).__init__(loc)
+        self.name = name
+        self.block = block
+        self.parameters = parameters
+
+
+class Call(Node):
+    def __init__(self, loc, label, expression=False):
+        super(Call, self).__init__(loc)
+        self.label = label
+        self.expression = expression
+
+
+class Jump(Node):
+    def __init__(self, loc, target, expression=False):
+        super(Jump, self).__init__(loc)
+        self.target = target
+        self.expression = expression
+
+
+class Menu(Node):
+    def __init__(self, loc, items):
+        super(Menu, self).__init__(loc)
+        self.items = items
+
+
+class If(Node):
+    def __init__(self, loc, entries):
+        super(If, self).__init__(loc)
+        self.entries = entries
+
+
+class While(Node):
+    def __init__(self, loc, condition, block):
+        super(While, self).__init__(loc)
+        self.condition = condition
+        self.block = block
+
+
+class ArgumentInfo(Node):
+    pass
+
+
+class Camera(Node):
+    pass
+
+
+class EndTranslate(Node):
+    pass
+
+
+class Hide(Node):
+    pass
+
+
+class Init(Node):
+    pass
+
+
+class ParameterInfo(Node):
+    pass
+
+
+class Pass(Node):
+    pass
+
+
+class Python(Node):
+    pass
+
+
+class Return(Node):
+    pass
+
+
+class Say(Node):
+    pass
+
+
+class Scene(Node):
+    pass
+
+
+class Show(Node):
+    pass
+
+
+class ShowLayer(Node):
+    pass
+
+
+class Translate(Node):
+    pass
+
+
+class UserStatement(Node):
+    pass
+
+
+class With(Node):
+    pass
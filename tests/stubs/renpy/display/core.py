@@ -0,0 +1,7 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+
+class Interface(object):
+    def interact(self):
+        return True
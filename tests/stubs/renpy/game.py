@@ -0,0 +1,10 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+script = None
+contexts = []
+after_rollback = False
+
+
+def context():
+    return contexts[-1]
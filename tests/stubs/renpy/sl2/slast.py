@@ -0,0 +1,14 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+
+class SLBlock(object):
+    pass
+
+
+class SLIf(object):
+    pass
+
+
+class SLShowIf(object):
+    pass
@@ -0,0 +1,110 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+from __future__ import unicode_literals
+
+import pytest
+
+renpy_ast = pytest.importorskip("renpy.ast")
+
+import renpy.game  # noqa: E402
+
+import gallery.ast_utils as ast_utils  # noqa: E402
+from gallery.ast_utils import create_end_replay_node, patch_after_node, walk_static_path  # noqa: E402
+
+
+class _Script(object):
+    """Script with the statements `nodes`, and its labels as the label nodes in them."""
+
+    def __init__(self, nodes):
+        self.all_stmts = nodes
+        self.namemap = {node.name: node for node in nodes}
+
+    def has_label(self, label_name):
+        return label_name in self.namemap
+
+    def lookup(self, label_name):
+        return self.namemap[label_name]
+
+
+def _label(label_name, block=()):
+    node = renpy_ast.Label(("game.rpy", 1), label_name, list(block), None)
+    node.name = label_name
+    return node
+
+
+def _statement(serial, node_type=None, *args):
+    node = (node_type or renpy_ast.Pass)(("game.rpy", serial), *args)
+    node.name = ("game.rpy", 0, serial)
+    return node
+
+
+def _chain(nodes):
+    for node, next_node in zip(nodes, nodes[1:]):
+        node.next = next_node
+
+
+@pytest.fixture
+def use_script(monkeypatch):
+    """Set the script to one with the passed nodes, and the `patch_with_` label the replay end nodes are copied from."""
+    end_replay = _statement(100, renpy_ast.Python)
+    patch_label = _label("patch_with_", [end_replay])
+    patch_label.next = end_replay
+    monkeypatch.setattr(ast_utils, "_stop_replay_node", None)
+
+    def use_script(nodes):
+        script = _Script(list(nodes) + [patch_label, end_replay])
+        monkeypatch.setattr(renpy.game, "script", script, raising=False)
+        return script
+
+    return use_script
+
+
+def test_walk_follows_calls_and_returns(use_script):
+    start = _label("start")
+    call = _statement(1, renpy_ast.Call, "called")
+    after_call = _statement(2)
+    called = _label("called")
+    called_statement = _statement(10)
+    return_ = _statement(11, renpy_ast.Return)
+    _chain([start, call, after_call])
+    _chain([called, called_statement, return_])
+    use_script([start, call, after_call, called, called_statement, return_])
+
+    assert list(walk_static_path(start)) == [start, call, called, called_statement, return_, after_call]
+
+
+def test_walk_follows_jumps_and_stops_at_dynamic_jumps(use_script):
+    start = _label("start")
+    jump = _statement(1, renpy_ast.Jump, "target")
+    skipped = _statement(2)
+    target = _label("target")
+    dynamic_jump = _statement(10, renpy_ast.Jump, "label_name", True)
+    _chain([start, jump, skipped])
+    _chain([target, dynamic_jump, _statement(11)])
+    use_script([start, jump, skipped, target, dynamic_jump])
+
+    assert list(walk_static_path(start)) == [start, jump, target, dynamic_jump]
+
+
+def test_walk_stops_before_replay_end_node(use_script):
+    start = _label("start")
+    statements = [_statement(serial) for serial in range(1, 4)]
+    _chain([start] + statements)
+    use_script([start] + statements)
+    end_replay_node = create_end_replay_node()
+    patch_after_node(statements[0], end_replay_node)
+
+    assert list(walk_static_path(start)) == [start, statements[0]]
+
+
+def test_walk_includes_patched_nodes(use_script):
+    start = _label("start")
+    statements = [_statement(serial) for serial in range(1, 3)]
+    _chain([start] + statements)
+    use_script([start] + statements)
+    patched_node = _statement(50)
+    ast_utils.mark_node_patched(patched_node)
+    patch_after_node(statements[0], patched_node)
+
+    assert list(walk_static_path(start)) == [start, statements[0], patched_node, statements[1]]
@@ -0,0 +1,156 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+from __future__ import unicode_literals
+
+import copy
+
+import pytest
+
+renpy_ast = pytest.importorskip("renpy.ast")
+
+import renpy.game  # noqa: E402
+
+from gallery.ast_utils import mark_node_patched, patch_after_node  # noqa: E402
+from gallery.control_flow import ControlFlowGraph  # noqa: E402
+
+
+class _Script(object):
+    """Script with the statements `nodes`, and its labels as the label nodes in them."""
+
+    def __init__(self, nodes):
+        self.all_stmts = nodes
+        self.namemap = {node.name: node for node in nodes}
+
+    def has_label(self, label_name):
+        return label_name in self.namemap
+
+    def lookup(self, label_name):
+        return self.namemap[label_name]
+
+
+def _label(label_name):
+    node = renpy_ast.Label(("game.rpy", 1), label_name, [], None)
+    node.name = label_name
+    return node
+
+
+def _statement(serial, node_type=None, *args):
+    node = (node_type or renpy_ast.Pass)(("game.rpy", serial), *args)
+    node.name = ("game.rpy", 0, serial)
+    return node
+
+
+def _chain(nodes):
+    for node, next_node in zip(nodes, nodes[1:]):
+        node.next = next_node
+
+
+@pytest.fixture
+def patched_script(monkeypatch):
+    """
+    Script where `start` falls through its statements, followed by the `patch_with_` label and the `other` label.
+
+    The statement after `start`'s second statement is a patched copy of `patch_with_`'s statement,
+    like the replay end nodes patched into replays.
+    """
+    start = _label("start")
+    start_statements = [_statement(serial) for serial in range(3)]
+    patch_label = _label("patch_with_")
+    end_replay = _statement(10)
+    other = _label("other")
+    other_statement = _statement(20)
+    _chain([start] + start_statements)
+    _chain([patch_label, end_replay, other, other_statement])
+
+    script = _Script([start] + start_statements + [patch_label, end_replay, other, other_statement])
+    monkeypatch.setattr(renpy.game, "script", script, raising=False)
+
+    end_replay_copy = copy.copy(end_replay)
+    mark_node_patched(end_replay_copy)
+    patch_after_node(start_statements[1], end_replay_copy)
+    return script, start, start_statements, end_replay_copy
+
+
+def test_static_path_skips_patched_copy(patched_script):
+    script, start, start_statements, _ = patched_script
+    graph = ControlFlowGraph.from_script(script)
+
+    assert [node for node, _ in graph.static_path(start)] == [start] + start_statements
+
+
+def test_patched_copy_has_id_of_next_script_node(patched_script):
+    script, _, start_statements, end_replay_copy = patched_script
+    graph = ControlFlowGraph.from_script(script)
+
+    assert graph.node_id(end_replay_copy) == graph.node_id(start_statements[2])
+
+
+def test_unpatched_copy_has_id_of_original(patched_script):
+    script, _, start_statements, _ = patched_script
+    graph = ControlFlowGraph.from_script(script)
+
+    assert graph.node_id(copy.copy(start_statements[0])) == graph.node_id(start_statements[0])
+
+
+@pytest.fixture
+def hub_script(monkeypatch):
+    """
+    Script where the `hub` label's menu merges and jumps back to the label, and `loop`'s while is in a loop too.
+
+    Neither label can reach the end of the script.
+    """
+    hub = _label("hub")
+    first_choice = _statement(1)
+    second_choice = _statement(2)
+    menu = _statement(3, renpy_ast.Menu, [("first", "True", [first_choice]), ("second", "True", [second_choice])])
+    after_menu = _statement(4)
+    hub_jump = _statement(5, renpy_ast.Jump, "hub")
+    _chain([hub, menu, after_menu, hub_jump])
+    first_choice.next = second_choice.next = after_menu
+
+    loop = _label("loop")
+    loop_statement = _statement(10)
+    while_ = _statement(11, renpy_ast.While, "True", [loop_statement])
+    after_while = _statement(12)
+    loop_jump = _statement(13, renpy_ast.Jump, "loop")
+    _chain([loop, while_, after_while, loop_jump])
+    loop_statement.next = while_
+
+    script = _Script(
+        [hub, menu, first_choice, second_choice, after_menu, hub_jump]
+        + [loop, while_, loop_statement, after_while, loop_jump]
+    )
+    monkeypatch.setattr(renpy.game, "script", script, raising=False)
+    return script, menu, after_menu, while_, after_while
+
+
+def test_menu_in_loop_merges_after_menu(hub_script):
+    script, menu, after_menu, _, _ = hub_script
+    graph = ControlFlowGraph.from_script(script)
+
+    assert graph.merge_node(menu) is after_menu
+
+
+def test_while_in_loop_merges_after_while(hub_script):
+    script, _, _, while_, after_while = hub_script
+    graph = ControlFlowGraph.from_script(script)
+
+    assert graph.merge_node(while_) is after_while
+
+
+def test_branches_merge_before_return(monkeypatch):
+    start = _label("start")
+    first_branch = _statement(1)
+    second_branch = _statement(2)
+    if_ = _statement(3, renpy_ast.If, [("flag", [first_branch]), ("True", [second_branch])])
+    after_if = _statement(4)
+    return_ = _statement(5, renpy_ast.Return)
+    _chain([start, if_, after_if, return_])
+    first_branch.next = second_branch.next = after_if
+    script = _Script([start, if_, first_branch, second_branch, after_if, return_])
+    monkeypatch.setattr(renpy.game, "script", script, raising=False)
+    graph = ControlFlowGraph.from_script(script)
+
+    assert graph.merge_node(if_) is after_if
+    assert graph.branch_nodes(if_) == [first_branch, second_branch]
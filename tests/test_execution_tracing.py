@@ -0,0 +1,131 @@
+# This file is a part of renpy-gallery-inject. See __init__.py for more details.
+# Copyright (C) 2022 Numerlor
+
+from __future__ import unicode_literals
+
+import hashlib
+
+import pytest
+
+renpy_ast = pytest.importorskip("renpy.ast")
+
+import renpy.config  # noqa: E402
+import renpy.game  # noqa: E402
+
+import script_jump.execution_tracing as execution_tracing  # noqa: E402
+from script_jump.execution_tracing import forked_child_logs, logs_with_node  # noqa: E402
+from script_jump.utils import ContinuationMarkerWrapper, LoopMarkerWrapper  # noqa: E402
+
+
+class _Script(object):
+    """Script with the statements `nodes`, and its labels as the label nodes in them."""
+
+    def __init__(self, nodes):
+        self.all_stmts = nodes
+        self.namemap = {node.name: node for node in nodes}
+        self.digest = hashlib.md5(repr(sorted(map(repr, self.namemap))).encode())
+
+    def has_label(self, label_name):
+        return label_name in self.namemap
+
+    def lookup(self, label_name):
+        return self.namemap[label_name]
+
+
+def _label(label_name):
+    node = renpy_ast.Label(("game.rpy", 1), label_name, [], None)
+    node.name = label_name
+    return node
+
+
+def _statement(serial, node_type=None, *args):
+    node = (node_type or renpy_ast.Pass)(("game.rpy", serial), *args)
+    node.name = ("game.rpy", 0, serial)
+    return node
+
+
+def _chain(nodes):
+    for node, next_node in zip(nodes, nodes[1:]):
+        node.next = next_node
+
+
+@pytest.fixture
+def hub_script(monkeypatch):
+    """Script where the `hub` label's menu merges after it, and then jumps back to the label."""
+    hub = _label("hub")
+    first_choice = _statement(1)
+    second_choice = _statement(2)
+    menu = _statement(3, renpy_ast.Menu, [("first", "True", [first_choice]), ("second", "True", [second_choice])])
+    after_menu = _statement(4)
+    hub_jump = _statement(5, renpy_ast.Jump, "hub")
+    _chain([hub, menu, after_menu, hub_jump])
+    first_choice.next = second_choice.next = after_menu
+
+    script = _Script([hub, menu, first_choice, second_choice, after_menu, hub_jump])
+    monkeypatch.setattr(renpy.game, "script", script, raising=False)
+    monkeypatch.setattr(renpy.config, "savedir", None, raising=False)
+    monkeypatch.setattr(execution_tracing, "_log_cache", execution_tracing._LogCache())
+    return script
+
+
+def _path(log):
+    return [wrapper.node for wrapper in log.nodes]
+
+
+def test_log_loops_back_to_hub(hub_script):
+    hub = hub_script.lookup("hub")
+    log = execution_tracing._log_cache.get(hub)
+
+    assert log.complete
+    assert _path(log) == [hub, hub.next, hub.next.next, hub.next.next.next, hub]
+    assert isinstance(log.nodes[-1], LoopMarkerWrapper)
+
+
+def test_forked_logs_share_path_after_merge(hub_script):
+    log = execution_tracing._log_cache.get(hub_script.lookup("hub"))
+    menu_wrapper = log.nodes[1]
+    after_menu = menu_wrapper.node.next
+
+    child_logs = forked_child_logs(menu_wrapper)
+
+    assert [_path(child_log) for child_log in child_logs] == [
+        [hub_script.all_stmts[2], after_menu],
+        [hub_script.all_stmts[3], after_menu],
+    ]
+    assert all(isinstance(child_log.nodes[-1], ContinuationMarkerWrapper) for child_log in child_logs)
+    # the merge node is only a marker in the forked logs, so only the log continuing from it contains it
+    assert logs_with_node(after_menu) == [log]
+    assert logs_with_node(hub_script.all_stmts[2]) == [child_logs[0]]
+
+
+def test_logs_with_shared_node(hub_script):
+    hub = hub_script.lookup("hub")
+    after_menu = hub_script.all_stmts[4]
+    log = execution_tracing._log_cache.get(hub)
+    continued_log = execution_tracing._log_cache.get(after_menu)
+
+    assert set(logs_with_node(hub_script.all_stmts[5])) == {log, continued_log}
+    assert execution_tracing._log_cache.get(after_menu) is continued_log
+
+
+def test_cache_evicts_least_recently_accessed_logs(hub_script, monkeypatch):
+    monkeypatch.setattr(execution_tracing, "LOG_MEMORY_BUDGET", 0)
+    hub = hub_script.lookup("hub")
+    after_menu = hub_script.all_stmts[4]
+    log = execution_tracing._log_cache.get(hub)
+    continued_log = execution_tracing._log_cache.get(after_menu)
+
+    # the most recently accessed log is always kept, evicted logs are removed from the dispatcher's index
+    assert logs_with_node(hub_script.all_stmts[5]) == [continued_log]
+    assert logs_with_node(hub) == [continued_log]
+    assert execution_tracing._log_cache.get(after_menu) is continued_log
+    assert execution_tracing._log_cache.get(hub) is not log
+
+
+def test_cache_keeps_logs_within_budget(hub_script):
+    cache = execution_tracing._LogCache(memory_budget=1024)
+    hub = hub_script.lookup("hub")
+    log = cache.get(hub)
+    cache.get(hub_script.all_stmts[4])
+
+    assert cache.get(hub) is log